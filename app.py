@@ -7,8 +7,12 @@ import base64
 from io import BytesIO
 import matplotlib.pyplot as plt
 from flask_backend.pdf_parser import parse_pdf
-from utils.model_interface import generate_questions_with_duplicate_check, solve_questions, update_questions_with_user_selections, generate_diagrams_for_selected_questions, generate_diagram_with_instructions, convert_question_difficulty
+from utils.model_interface import solve_questions, update_questions_with_user_selections, generate_diagrams_for_selected_questions, generate_diagram_with_instructions, convert_question_difficulty
 from utils.diagram_generator import DiagramGenerator
+from utils.async_pipeline import run_question_pipeline
+from utils.dedup import record_generated_questions, dedup_service
+from utils.question_store import question_store
+from utils.question_export import export_questions, export_filename, available_export_formats, available_export_compressions, EXPORT_DIR
 from components.difficulty_selector import create_difficulty_selector
 import traceback, re
 import numpy as np 
@@ -21,6 +25,9 @@ import warnings
 from matplotlib import font_manager
 import matplotlib
 import uuid
+import secrets
+import threading
+from itertools import chain
 import subprocess
 import fitz
 from PIL import Image
@@ -73,6 +80,8 @@ if 'conversation_data' not in st.session_state:
 
 frontend_url = os.getenv("FRONTEND_URL")
 backend_url = os.getenv("BACKEND_FLASK_QBMS_APP")
+# Questions sent per /api/questions/index request when backfilling the similarity index
+QUESTION_INDEX_BACKFILL_BATCH = int(os.getenv("QUESTION_INDEX_BACKFILL_BATCH", "200"))
 
 def load_conversation_data():
     query_params = st.query_params
@@ -118,6 +127,66 @@ def search_content_via_api(query: str, doc_id: str = None, max_tokens: int = 120
         st.error(f"Failed to call API: {str(e)}")
         return []
 
+def index_questions_via_api(questions, timeout=60):
+    """
+    Add questions to the backend's embedding collection used for semantic duplicate checks
+
+    Returns:
+        int: Number of questions indexed, or None if the request failed
+    """
+    if not backend_url or not questions:
+        return 0
+    try:
+        response = requests.post(
+            f'{backend_url}/api/questions/index',
+            json={"questions": [{k: q.get(k) for k in ("id", "question", "subject", "source", "difficulty")} for q in questions]},
+            timeout=timeout
+        )
+        if response.status_code == 200:
+            return response.json().get("indexed", 0)
+        print(f"Question indexing API error: {response.text}")
+    except Exception as e:
+        print(f"Failed to index questions: {str(e)}")
+    return None
+
+def backfill_question_index(batch_size=QUESTION_INDEX_BACKFILL_BATCH):
+    """
+    One-time push of the existing question bank (the question store and data/generated) into the
+    backend's similarity index, so semantic duplicate checks also cover questions generated before
+    the index existed. Completion is recorded in store_meta; an interrupted backfill starts over on
+    the next run, which is safe because indexing is idempotent per question text.
+    """
+    if not backend_url or question_store.get_meta("question_index_backfilled"):
+        return
+
+    indexed = 0
+    batch = []
+    for question in chain(question_store.iter_questions(), dedup_service.corpus()):
+        batch.append(question)
+        if len(batch) >= batch_size:
+            count = index_questions_via_api(batch, timeout=300)
+            if count is None:
+                return
+            indexed += count
+            batch = []
+    if batch:
+        count = index_questions_via_api(batch, timeout=300)
+        if count is None:
+            return
+        indexed += count
+
+    question_store.set_meta("question_index_backfilled", datetime.now().isoformat())
+    print(f"Backfilled {indexed} questions into the similarity index")
+
+@st.cache_resource(show_spinner=False)
+def start_question_index_backfill():
+    """Run the backfill once per process, in the background so page loads are not blocked"""
+    thread = threading.Thread(target=backfill_question_index, daemon=True)
+    thread.start()
+    return thread
+
+start_question_index_backfill()
+
 def get_relevant_content_for_question_generation(conversation_data: dict, doc_id: str):
     if not conversation_data:
         return None
@@ -171,23 +240,6 @@ def save_documents_index():
 if not st.session_state.documents:
     st.session_state.documents = load_existing_documents()
 
-# Function to load previously generated questions
-def load_previous_questions():
-    """Load all previously generated questions from the generated directory"""
-    all_questions = []
-    if os.path.exists("data/generated"):
-        for filename in os.listdir("data/generated"):
-            if filename.endswith("_questions.json") or filename.endswith("_questions_with_diagrams.json"):
-                try:
-                    with open(os.path.join("data/generated", filename), "r") as f:
-                        data = json.load(f)
-                        if "questions" in data and isinstance(data["questions"], list):
-                            all_questions.extend(data["questions"])
-                except Exception as e:
-                    print(f"Error loading {filename}: {e}")
-    
-    return all_questions
-
 def render_diagram(matplotlib_code, question_id):
     """
     Render diagram code to an in-memory buffer using matplotlib.
@@ -325,7 +377,8 @@ def display_questions_with_selection(questions, show_diagrams=True, enable_selec
                                     question, 
                                     content,
                                     subject, 
-                                    new_difficulty
+                                    new_difficulty,
+                                    use_cache=False
                                 )
                                 
                                 questions[i] = modified_question
@@ -398,7 +451,8 @@ def display_questions_with_selection(questions, show_diagrams=True, enable_selec
                                 try:
                                     modified_diagram_code = generate_diagram_with_instructions(
                                         question,
-                                        modification_instructions
+                                        modification_instructions,
+                                        use_cache=False
                                     )
                                     if modified_diagram_code:
                                         question['diagram_matplotlib'] = modified_diagram_code
@@ -737,7 +791,7 @@ def render_matplotlib_code(code, question_id, diagram_type=None, figsize=(4, 3),
 # Function to process diagrams for specific questions
 def process_diagrams_for_selected_questions(all_questions, selected_ids):
     updated_questions = update_questions_with_user_selections(all_questions, selected_ids)
-    diagram_matplotlib_code = generate_diagrams_for_selected_questions(updated_questions)
+    diagram_matplotlib_code = generate_diagrams_for_selected_questions(updated_questions, use_cache=False)
     
     for question in updated_questions:
         question_id = question.get('id')
@@ -748,6 +802,52 @@ def process_diagrams_for_selected_questions(all_questions, selected_ids):
     return updated_questions
 
 # Function to filter questions with diagrams
+def _figure_png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False)
+def render_subject_chart(subject_counts):
+    """Bar chart PNG of (subject, count) pairs, cached until the counts change"""
+    fig, ax = plt.subplots(figsize=(4, 3))  # Smaller size
+    sorted_data = sorted(subject_counts, key=lambda x: x[1], reverse=True)
+    subjects, counts = zip(*sorted_data) if sorted_data else ([], [])
+    ax.bar(subjects, counts)
+    ax.set_xlabel('Subject')
+    ax.set_ylabel('Count')
+    ax.set_title('Subjects')
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+    fig.tight_layout()
+    return _figure_png(fig)
+
+@st.cache_data(show_spinner=False)
+def render_difficulty_chart(difficulty_counts):
+    """Pie chart PNG of (difficulty, count) pairs, cached until the counts change"""
+    fig, ax = plt.subplots(figsize=(4, 3))  # Smaller size
+    difficulties = [d for d, _ in difficulty_counts]
+    counts = [c for _, c in difficulty_counts]
+    colors = {'easy': 'green', 'medium': 'blue', 'hard': 'red'}
+    difficulty_colors = [colors.get(d, 'gray') for d in difficulties]
+    ax.pie(counts, labels=difficulties, autopct='%1.1f%%', startangle=90, colors=difficulty_colors)
+    ax.axis('equal')
+    ax.set_title('Difficulty')
+    return _figure_png(fig)
+
+@st.cache_data(show_spinner=False)
+def render_date_chart(day_counts):
+    """Bar chart PNG of (YYYYMMDD, count) pairs, cached until the counts change"""
+    fig, ax = plt.subplots(figsize=(4, 3))  # Smaller size
+    days = [f"{d[:4]}-{d[4:6]}-{d[6:8]}" if len(d or '') == 8 else (d or 'Unknown') for d, _ in day_counts]
+    ax.bar(days, [c for _, c in day_counts])
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Count')
+    ax.set_title('Generated')
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+    fig.tight_layout()
+    return _figure_png(fig)
+
 def filter_diagram_questions(questions):
     """Filter questions that require diagrams"""
     return [q for q in questions if q.get('requires_diagram', False)]
@@ -763,18 +863,6 @@ def save_to_question_database(questions, source_document=None):
     # Create a timestamp for the database file
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    # Load existing database if it exists
-    db_path = "data/question_database/all_questions.json"
-    if os.path.exists(db_path):
-        with open(db_path, "r") as f:
-            try:
-                existing_db = json.load(f)
-                existing_questions = existing_db.get("questions", [])
-            except json.JSONDecodeError:
-                existing_questions = []
-    else:
-        existing_questions = []
-    
     # Add source to each question if provided
     if source_document:
         for question in questions:
@@ -795,108 +883,13 @@ def save_to_question_database(questions, source_document=None):
                 title = title[:97] + '...'
             question["title"] = title
     
-    # Process each question - update if title matches, otherwise add as new
-    new_questions_count = 0
-    updated_questions_count = 0
-    
-    # Create a dictionary of existing questions by title for faster lookup
-    existing_question_dict = {}
-    for q in existing_questions:
-        if "title" in q and q["title"]:
-            existing_question_dict[q["title"]] = q
-    
-    final_questions = []
-    processed_titles = set()  # Track processed titles to avoid duplicates
-    
-    # First process all existing questions
-    for existing_q in existing_questions:
-        title = existing_q.get("title", "")
-        
-        # Skip if we've already processed this title
-        if title in processed_titles:
-            continue
-            
-        # Check if this question should be updated
-        found_update = False
-        for new_q in questions:
-            if new_q.get("title", "") == title:
-                # Update the existing question with new data, preserving the ID
-                updated_q = {**existing_q, **new_q}
-                final_questions.append(updated_q)
-                processed_titles.add(title)
-                updated_questions_count += 1
-                found_update = True
-                break
-                
-        # If no update was found, keep the original
-        if not found_update:
-            final_questions.append(existing_q)
-            processed_titles.add(title)
-    
-    # Now add any new questions that weren't updates
-    for new_q in questions:
-        title = new_q.get("title", "")
-        if title and title not in processed_titles:
-            final_questions.append(new_q)
-            processed_titles.add(title)
-            new_questions_count += 1
-    
-    # Save updated database
-    with open(db_path, "w") as f:
-        json.dump({"questions": final_questions}, f, indent=2)
-    
-    # Return counts of new and updated questions
-    return new_questions_count, updated_questions_count
+    # Update questions whose title already exists, add the rest as new
+    return question_store.upsert_questions(questions)
 
 # Function to load all questions from the database
 def load_question_database():
     """Load all questions from the centralized question database"""
-    db_path = "data/question_database/all_questions.json"
-    if os.path.exists(db_path):
-        with open(db_path, "r") as f:
-            try:
-                data = json.load(f)
-                return data.get("questions", [])
-            except json.JSONDecodeError:
-                return []
-    return []
-
-# Improve the duplicate question detection function
-def is_duplicate_question(question, existing_questions, similarity_threshold=0.8):
-    """
-    Check if a question is too similar to any existing questions
-    
-    Args:
-        question (dict): The new question to check
-        existing_questions (list): List of existing question dictionaries
-        similarity_threshold (float): Threshold for considering questions similar (0-1)
-        
-    Returns:
-        bool: True if the question is a duplicate, False otherwise
-    """
-    from difflib import SequenceMatcher
-    
-    question_text = question.get('question', '').lower()
-    question_id = question.get('id', '')
-    
-    if not question_text:
-        return False
-    
-    for existing in existing_questions:
-        # If IDs match and aren't empty, it's the same question
-        if question_id and question_id == existing.get('id', ''):
-            return True
-            
-        existing_text = existing.get('question', '').lower()
-        if not existing_text:
-            continue
-        
-        # Calculate similarity ratio
-        similarity = SequenceMatcher(None, question_text, existing_text).ratio()
-        if similarity >= similarity_threshold:
-            return True
-    
-    return False
+    return question_store.load_all()
 
 # App title
 st.markdown("# Training Session")
@@ -986,13 +979,14 @@ with generate_tab:
                     # content_to_use = {i+1: page for i, page in enumerate(doc['content'])}
                     
                     # print("content", content_to_use)
-                    # Generate questions with duplicate checking
-                    questions = generate_questions_with_duplicate_check(
+                    # Generate, deduplicate and verify questions as they stream from the model
+                    questions = run_question_pipeline(
                         content=content_to_use,
                         subject=doc['subject'],
                         num_questions=num_questions,
                         difficulty_distribution=difficulty_options,
-                        conversation_data=conversation_data
+                        conversation_data=conversation_data,
+                        use_cache=False
                     )
                     
                     # Add subject and ensure each question has a title
@@ -1017,9 +1011,11 @@ with generate_tab:
                     question_file_path = f"data/generated/{st.session_state.selected_doc}_questions.json"
                     with open(question_file_path, "w") as f:
                         json.dump({"questions": questions}, f)
+                    record_generated_questions(question_file_path, questions)
                     
                     # Save to centralized question database
                     new_count, updated_count = save_to_question_database(questions, doc['name'])
+                    index_questions_via_api(questions)
                     
                     st.success(f"Generated {len(questions)} questions! Added {new_count} new questions and updated {updated_count} existing questions in the database.")
                     
@@ -1061,6 +1057,7 @@ with generate_tab:
                             question_file_path = f"data/generated/{st.session_state.selected_doc}_questions_with_diagrams.json"
                             with open(question_file_path, "w") as f:
                                 json.dump({"questions": updated_questions}, f)
+                            record_generated_questions(question_file_path, updated_questions)
                             
                             st.success(f"Generated diagrams for {len(selected_questions)} questions!")
                             st.rerun()  # Use st.rerun() instead of st.experimental_rerun()
@@ -1146,17 +1143,17 @@ with generate_tab:
 with view_all_tab:
     st.header("Question Database")
     
-    # Load all questions from the database
-    all_questions = load_question_database()
+    # Count questions in the database (filtering and paging happen in the store)
+    total_questions = question_store.count()
     
-    if not all_questions:
+    if not total_questions:
         st.info("No questions have been generated yet. Generate questions in the 'Generate Questions' tab.")
     else:
-        st.write(f"Found {len(all_questions)} questions in the database.")
+        st.write(f"Found {total_questions} questions in the database.")
         
         # Add filtering options
-        subjects = sorted(list(set(q.get('subject', 'Unknown') for q in all_questions)))
-        difficulties = sorted(list(set(q.get('difficulty', 'medium') for q in all_questions)))
+        subjects = list(question_store.facet_counts("subject"))
+        difficulties = list(question_store.facet_counts("difficulty"))
         
         # Create column layout for filters
         col1, col2, col3 = st.columns(3)
@@ -1165,29 +1162,36 @@ with view_all_tab:
             filter_subject = st.multiselect("Filter by Subject", subjects, default=subjects)
         with col2:
             filter_difficulty = st.multiselect("Filter by Difficulty", difficulties, default=difficulties)
-        
+        with col3:
+            page_size = st.selectbox("Questions per page", [25, 50, 100, 200], index=1)
             
         # Add search functionality
         search_query = st.text_input("Search questions", "")
         
-        # Apply filters and search
-        filtered_questions = []
-        for q in all_questions:
-            if (q.get('subject', 'Unknown') in filter_subject and
-                q.get('difficulty', 'medium') in filter_difficulty):
-                
-                # Apply search if provided
-                if search_query:
-                    question_text = q.get('question', '').lower()
-                    if search_query.lower() in question_text:
-                        filtered_questions.append(q)
-                else:
-                    filtered_questions.append(q)
+        # Apply filters and search in the store
+        question_filters = {
+            "subjects": filter_subject,
+            "difficulties": filter_difficulty,
+            "search": search_query or None
+        }
+        filtered_count = question_store.count_questions(**question_filters)
         
-        st.write(f"Showing {len(filtered_questions)} questions after filtering.")
+        st.write(f"Showing {filtered_count} questions after filtering.")
         
-        # Sort questions (newest first)
-        filtered_questions.sort(key=lambda q: q.get('generated_on', ''), reverse=True)
+        # Fetch only the current page (best matches first when searching, otherwise newest first)
+        page_count = max(1, math.ceil(filtered_count / page_size))
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, step=1)
+        search_snippets = []
+        if search_query:
+            search_results = question_store.search_questions(
+                search_query, filter_subject, filter_difficulty, limit=page_size, offset=(page - 1) * page_size
+            )
+            filtered_questions = [question for question, _ in search_results]
+            search_snippets = [snippet for _, snippet in search_results]
+        else:
+            filtered_questions = question_store.query_questions(
+                **question_filters, limit=page_size, offset=(page - 1) * page_size
+            )
         
         # Setup tabs for different views
         list_tab, analyze_tab = st.tabs(["Question List", "Question Analytics"])
@@ -1199,7 +1203,7 @@ with view_all_tab:
                 df_data = []
                 for i, q in enumerate(filtered_questions):
                     df_data.append({
-                        "ID": q.get('id', f'q{i}'),
+                        "ID": q.get('id', f'q{(page - 1) * page_size + i}'),
                         "Question": q.get('question', 'No question text'),
                         "Subject": q.get('subject', 'Unknown'),
                         "Difficulty": q.get('difficulty', 'medium').capitalize(),
@@ -1210,6 +1214,12 @@ with view_all_tab:
                 df = pd.DataFrame(df_data)
                 st.dataframe(df, use_container_width=True)
                 
+                # Show where the search terms matched
+                if search_snippets:
+                    with st.expander("Search matches", expanded=True):
+                        for q, snippet in zip(filtered_questions, search_snippets):
+                            st.markdown(f"- **{q.get('id', '')}**: {snippet}")
+                
                 # Detail view for selected question
                 st.subheader("Question Details")
                 selected_question_idx = st.selectbox(
@@ -1278,68 +1288,68 @@ with view_all_tab:
             st.subheader("Question Analytics")
             
             # Create analysis visualizations
-            if filtered_questions:
+            if filtered_count:
                 col1, col2, col3 = st.columns(3)
 
+                # Counts come from the store's aggregate counters; charts are only redrawn when they change
                 # Subject distribution
                 with col1:
                     st.subheader("By Subject")
-                    subject_counts = {}
-                    for q in filtered_questions:
-                        subject = q.get('subject', 'Unknown')
-                        subject_counts[subject] = subject_counts.get(subject, 0) + 1
-                    
-                    fig, ax = plt.subplots(figsize=(4, 3))  # Smaller size
-                    subjects = list(subject_counts.keys())
-                    counts = list(subject_counts.values())
-                    sorted_data = sorted(zip(subjects, counts), key=lambda x: x[1], reverse=True)
-                    subjects, counts = zip(*sorted_data) if sorted_data else ([], [])
-                    ax.bar(subjects, counts)
-                    ax.set_xlabel('Subject')
-                    ax.set_ylabel('Count')
-                    ax.set_title('Subjects')
-                    plt.xticks(rotation=45, ha='right')
-                    plt.tight_layout()
-                    st.pyplot(fig)
+                    subject_counts = question_store.facet_counts("subject", **question_filters)
+                    st.image(render_subject_chart(tuple(subject_counts.items())))
 
                 # Difficulty distribution
                 with col2:
                     st.subheader("By Difficulty")
-                    difficulty_counts = {}
-                    for q in filtered_questions:
-                        difficulty = q.get('difficulty', 'medium')
-                        difficulty_counts[difficulty] = difficulty_counts.get(difficulty, 0) + 1
-
-                    fig, ax = plt.subplots(figsize=(4, 3))  # Smaller size
-                    difficulties = list(difficulty_counts.keys())
-                    counts = list(difficulty_counts.values())
-                    colors = {'easy': 'green', 'medium': 'blue', 'hard': 'red'}
-                    difficulty_colors = [colors.get(d, 'gray') for d in difficulties]
-                    ax.pie(counts, labels=difficulties, autopct='%1.1f%%', startangle=90, colors=difficulty_colors)
-                    ax.axis('equal')
-                    ax.set_title('Difficulty')
-                    st.pyplot(fig)
+                    difficulty_counts = question_store.facet_counts("difficulty", **question_filters)
+                    st.image(render_difficulty_chart(tuple(difficulty_counts.items())))
+
+                # Generation date distribution and diagram share
+                with col3:
+                    st.subheader("By Date")
+                    day_counts = question_store.facet_counts("generated_day", **question_filters)
+                    st.image(render_date_chart(tuple(day_counts.items())))
+                    diagram_counts = question_store.facet_counts("has_diagram", **question_filters)
+                    st.metric("Questions with diagrams", diagram_counts.get(1, 0))
 
             else:
                 st.info("No questions available for analysis based on your current filters.")
 
         # Add ability to export filtered questions
         st.subheader("Export Questions")
-        if filtered_questions:
-            if st.button("Export Filtered Questions to JSON"):
-                export_path = f"data/exports/questions_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                os.makedirs("data/exports", exist_ok=True)
-                
-                with open(export_path, "w") as f:
-                    json.dump({"questions": filtered_questions}, f, indent=2)
-                
-                st.success(f"Exported {len(filtered_questions)} questions to {export_path}")
+        if filtered_count:
+            export_col1, export_col2 = st.columns(2)
+            with export_col1:
+                export_format = st.selectbox("Format", available_export_formats(), format_func=str.upper)
+            with export_col2:
+                export_compression = st.selectbox(
+                    "Compression", available_export_compressions(export_format), format_func=lambda c: c or "none"
+                )
+            
+            if st.button("Export Filtered Questions"):
+                # The random suffix keeps exports, which are served without authentication, from being guessable
+                export_name = export_filename(
+                    f"questions_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_urlsafe(12)}",
+                    export_format,
+                    export_compression
+                )
+                export_path = os.path.join(EXPORT_DIR, export_name)
                 
-                # Provide download link
-                with open(export_path, "r") as f:
-                    st.download_button(
-                        label="Download JSON File",
-                        data=f,
-                        file_name=f"questions_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                        mime="application/json"
+                # Stream rows from the store straight into the export file
+                try:
+                    exported_count = export_questions(
+                        question_store.iter_questions(**question_filters),
+                        export_path,
+                        fmt=export_format,
+                        compression=export_compression
+                    )
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success(f"Exported {exported_count} questions to {export_path}")
+                    
+                    # Streamlit's static file server sends the file from disk; st.download_button would load it all into memory
+                    st.markdown(
+                        f'<a href="app/static/exports/{export_name}" download="{export_name}">Download {export_name}</a>',
+                        unsafe_allow_html=True
                     )
\ No newline at end of file
@@ -1,18 +1,24 @@
 import streamlit as st
 from flask import Flask, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
 from dotenv import load_dotenv
 from flask_cors import CORS
 import threading
 import base64
-import tempfile
+import uuid
 import os
 import json
+import hashlib
+import re
 from pdf_parser import parse_pdf
+from embedding_cache import CachedEmbeddings
+from embedding_scheduler import EmbeddingScheduler
+from job_queue import JobQueue
 import time
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
-from langchain_core.documents import Document
 import chromadb
 from datetime import datetime
 
@@ -22,6 +28,12 @@ api_app = Flask(__name__)
 CORS(api_app)  
 
 CHROMA_DB_PATH = "data/chroma_db"
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Largest number of records written to Chroma in one call
+CHROMA_WRITE_BATCH = 1000
+QUESTION_COLLECTION = "question_embeddings"
+# Cosine similarity at or above which a candidate counts as a semantic duplicate
+QUESTION_SIMILARITY_THRESHOLD = float(os.getenv("QUESTION_SIMILARITY_THRESHOLD", "0.92"))
 OPENAI_API_KEY = os.getenv("CHATGPT_API_KEY")
 print("key", OPENAI_API_KEY)
 
@@ -34,9 +46,18 @@ os.makedirs("data/processed", exist_ok=True)
 class RAGSystem:
     def __init__(self):
         print("Initializing RAG system...")  
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-ada-002",
+        # Vectors are cached by chunk content, so re-uploaded documents only embed changed chunks.
+        # Cache misses go through the scheduler, which handles batching, concurrency and 429 backoff
+        # itself, so the client's own retries are disabled.
+        openai_embeddings = OpenAIEmbeddings(
+            model=EMBEDDING_MODEL,
             api_key=OPENAI_API_KEY, 
+            max_retries=0
+        )
+        self.embeddings = CachedEmbeddings(
+            openai_embeddings,
+            model=EMBEDDING_MODEL,
+            scheduler=EmbeddingScheduler(openai_embeddings.embed_documents)
         )
         print("Embeddings initialized:", self.embeddings) 
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -51,32 +72,98 @@ class RAGSystem:
             )
             if not hasattr(self.vectorstore, '_collection'):
                 raise Exception("Chroma collection not initialized properly")
+            self.question_store = Chroma(
+                collection_name=QUESTION_COLLECTION,
+                persist_directory=CHROMA_DB_PATH,
+                embedding_function=self.embeddings,
+                collection_metadata={"hnsw:space": "cosine"}
+            )
         except Exception as e:
             print(f"Failed to initialize Chroma: {str(e)}")
             raise
 
-    def add_document(self, doc_id: str, text: str, metadata: dict = None):
-        self.delete_document(doc_id, silent=True)
+    @staticmethod
+    def chunk_ids(doc_id: str, chunks):
+        """
+        Stable chunk IDs: document ID, content hash and occurrence number of identical chunks
+
+        An unchanged chunk keeps its ID (and stored vector) across re-uploads,
+        even if edits elsewhere shift its position in the document.
+        """
+        occurrences = {}
+        ids = []
+        for chunk in chunks:
+            chunk_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+            occurrence = occurrences.get(chunk_hash, 0)
+            occurrences[chunk_hash] = occurrence + 1
+            ids.append(f"{doc_id}:{chunk_hash[:32]}:{occurrence}")
+        return ids
+
+    def add_document(self, doc_id: str, text: str, metadata: dict = None, progress_callback=None):
+        """
+        Index a document, re-embedding only chunks that changed since the last upload
+
+        Args:
+            progress_callback (callable): Called as progress_callback(done, total) while new chunks are embedded
+
+        Returns:
+            int: Number of chunks in the document
+        """
         chunks = self.text_splitter.split_text(text)
-        documents = [
-            Document(page_content=chunk, metadata={
+        ids = self.chunk_ids(doc_id, chunks)
+        collection = self.vectorstore._collection
+
+        existing = collection.get(where={"doc_id": doc_id}, include=["metadatas"])
+        existing_metadata = dict(zip(existing.get("ids", []), existing.get("metadatas") or []))
+
+        current_ids = set(ids)
+        stale_ids = [chunk_id for chunk_id in existing_metadata if chunk_id not in current_ids]
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+
+        now = datetime.utcnow().isoformat()
+        new_chunks, new_metadatas, new_ids = [], [], []
+        changed_ids, changed_metadatas = [], []
+        for i, (chunk_id, chunk) in enumerate(zip(ids, chunks)):
+            old_metadata = existing_metadata.get(chunk_id)
+            chunk_metadata = {
                 "doc_id": doc_id,
                 "chunk_index": i,
-                "created_at": datetime.utcnow().isoformat(), 
+                "chunk_hash": chunk_id.split(":")[-2],
+                "created_at": (old_metadata or {}).get("created_at", now),
                 **(metadata or {})
-            }) for i, chunk in enumerate(chunks)
-        ]
-        if documents:
-            self.vectorstore.add_documents(documents)
-            return len(documents)
-        return 0
+            }
+            if old_metadata is None:
+                new_chunks.append(chunk)
+                new_metadatas.append(chunk_metadata)
+                new_ids.append(chunk_id)
+            elif old_metadata != chunk_metadata:
+                changed_ids.append(chunk_id)
+                changed_metadatas.append(chunk_metadata)
+
+        if changed_ids:
+            collection.update(ids=changed_ids, metadatas=changed_metadatas)
+        if new_chunks:
+            vectors = self.embeddings.embed_documents(new_chunks, progress_callback=progress_callback)
+            for start in range(0, len(new_ids), CHROMA_WRITE_BATCH):
+                end = start + CHROMA_WRITE_BATCH
+                collection.upsert(
+                    ids=new_ids[start:end],
+                    embeddings=vectors[start:end],
+                    documents=new_chunks[start:end],
+                    metadatas=new_metadatas[start:end]
+                )
+
+        print(f"Indexed {doc_id}: {len(new_ids)} new, {len(stale_ids)} removed, "
+              f"{len(chunks) - len(new_ids)} unchanged chunks")
+        return len(chunks)
 
     def delete_document(self, doc_id: str, silent: bool = False):
         collection = self.vectorstore._collection
-        existing = collection.get(where={"doc_id": doc_id})
-        if existing and existing.get("ids"):
-            collection.delete(where={"doc_id": doc_id})
-            return len(existing["ids"])
+        existing_ids = collection.get(where={"doc_id": doc_id}, include=[]).get("ids", [])
+        if existing_ids:
+            collection.delete(ids=existing_ids)
+            return len(existing_ids)
         elif not silent:
             print(f"No chunks found for document {doc_id}")
         return 0
@@ -104,6 +191,71 @@ class RAGSystem:
             print(f"Search error: {str(e)}")
             return []
 
+    @staticmethod
+    def _question_text(question):
+        text = question.get('question', '') if isinstance(question, dict) else question
+        return re.sub(r"\s+", " ", str(text or "")).strip()
+
+    @staticmethod
+    def _question_embedding_id(text):
+        return hashlib.sha256(text.lower().encode("utf-8")).hexdigest()
+
+    def index_questions(self, questions):
+        """Embed and store questions for semantic duplicate search (idempotent per question text)"""
+        entries = {}
+        for question in questions:
+            text = self._question_text(question)
+            if not text:
+                continue
+            metadata = {"indexed_at": datetime.utcnow().isoformat()}
+            if isinstance(question, dict):
+                for key in ("id", "subject", "source", "difficulty"):
+                    if isinstance(question.get(key), (str, int, float, bool)):
+                        metadata[key] = question[key]
+            entries[self._question_embedding_id(text)] = (text, metadata)
+
+        if not entries:
+            return 0
+
+        ids = list(entries)
+        self.question_store._collection.upsert(
+            ids=ids,
+            documents=[entries[entry_id][0] for entry_id in ids],
+            metadatas=[entries[entry_id][1] for entry_id in ids],
+            embeddings=self.embeddings.embed_documents([entries[entry_id][0] for entry_id in ids])
+        )
+        return len(ids)
+
+    def find_similar_questions(self, questions, n_results: int = 1):
+        """
+        Nearest indexed questions for a batch of candidates, using one embedding call and one vector query
+
+        Returns:
+            list: One list of {"question", "similarity", "metadata"} neighbours per candidate
+        """
+        texts = [self._question_text(question) for question in questions]
+        neighbours = [[] for _ in texts]
+        positions = [i for i, text in enumerate(texts) if text]
+
+        collection = self.question_store._collection
+        indexed = collection.count()
+        if not positions or not indexed:
+            return neighbours
+
+        results = collection.query(
+            query_embeddings=self.embeddings.embed_documents([texts[i] for i in positions]),
+            n_results=min(n_results, indexed),
+            include=["documents", "metadatas", "distances"]
+        )
+        for position, documents, metadatas, distances in zip(
+            positions, results["documents"], results["metadatas"], results["distances"]
+        ):
+            neighbours[position] = [
+                {"question": document, "similarity": 1.0 - float(distance), "metadata": metadata or {}}
+                for document, metadata, distance in zip(documents, metadatas, distances)
+            ]
+        return neighbours
+
     def get_relevant_content(self, query: str, max_tokens: int = 120000, doc_id: str = None):
         try:
             all_results = []
@@ -151,6 +303,141 @@ def load_existing_documents():
             return json.load(f)
     return {}
 
+UPLOAD_DIR = "data/uploads"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Largest PDF accepted by the streaming upload endpoint, and the read size used while streaming it to disk
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Memory allowed for multipart form fields and the parser's buffer (file parts go to disk)
+UPLOAD_FORM_MEMORY = 1024 * 1024
+
+# Serializes writes to the shared documents index, and re-indexing of the same document, across ingestion workers
+documents_index_lock = threading.Lock()
+document_locks = {}
+
+def document_lock(document_id):
+    with documents_index_lock:
+        return document_locks.setdefault(document_id, threading.Lock())
+
+def ingest_document(payload, report):
+    """
+    Ingestion job: parse an uploaded PDF, index its chunks and save the processed document
+
+    Args:
+        payload (dict): path, filename, subject, exam_type and document_id of the upload
+        report (callable): report(stage, progress) updates the job status
+
+    Returns:
+        dict: document_id and number of indexed chunks
+    """
+    document_id = payload["document_id"]
+    subject = payload["subject"]
+
+    # The upload is removed whether ingestion succeeds or fails; it is only kept if the process
+    # dies mid-job, so the requeued job can pick it up again after a restart
+    try:
+        report("parsing", 5)
+        text_by_page, images_by_page = parse_pdf(payload["path"])
+        full_text = "\n".join(text_by_page)
+
+        metadata = {
+            "filename": payload["filename"],
+            "subject": subject,
+            "exam_type": payload["exam_type"],
+            "pages": len(text_by_page)
+        }
+
+        # Embedding dominates ingestion time, so it gets most of the progress range
+        report("embedding", 20)
+        def embedding_progress(done, total):
+            report("embedding", 20 + 70 * done / max(total, 1))
+
+        with document_lock(document_id):
+            chunk_count = rag_system.add_document(document_id, full_text, metadata, progress_callback=embedding_progress)
+
+            report("saving", 90)
+            with open(f"data/processed/{document_id}.json", "w") as f:
+                json.dump({
+                    "type": "pdf",
+                    "name": payload["filename"],
+                    "subject": subject,
+                    "exam_type": payload["exam_type"],
+                    "content": text_by_page,
+                    "images": images_by_page
+                }, f)
+
+        with documents_index_lock:
+            documents = load_existing_documents()
+            documents[document_id] = {
+                "type": "pdf",
+                "name": payload["filename"],
+                "subject": subject,
+                "exam_type": payload["exam_type"],
+                "content": text_by_page,
+                "images": images_by_page,
+                "path": f"data/processed/{document_id}.json"
+            }
+            with open("data/documents_index.json", "w") as f:
+                json.dump(documents, f)
+    finally:
+        if os.path.exists(payload["path"]):
+            os.unlink(payload["path"])
+
+    return {"document_id": document_id, "chunks": chunk_count}
+
+job_queue = JobQueue(handlers={"ingest_document": ingest_document})
+
+class HashingUploadFile:
+    """
+    File an upload is streamed into: data goes straight to disk while its sha256
+    and size are computed, and writing past max_bytes raises RequestEntityTooLarge
+    """
+
+    def __init__(self, path, max_bytes=MAX_UPLOAD_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.file = open(path, "wb")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+def queue_ingestion(job_id, upload_path, filename, subject, exam_type, sha256=None):
+    """Enqueue an ingestion job for a PDF saved at upload_path and build the 202 response"""
+    document_id = f"{subject.lower().replace(' ', '')}_1"
+
+    try:
+        job_queue.enqueue("ingest_document", {
+            "path": upload_path,
+            "filename": filename,
+            "subject": subject,
+            "exam_type": exam_type,
+            "document_id": document_id,
+            "sha256": sha256
+        }, job_id=job_id)
+    except Exception:
+        # No job will ever pick the file up
+        os.unlink(upload_path)
+        raise
+
+    response = {
+        'success': True,
+        'message': f'Document queued for processing. Check /api/jobs/{job_id} for progress.',
+        'job_id': job_id,
+        'document_id': document_id
+    }
+    if sha256:
+        response['sha256'] = sha256
+    return jsonify(response), 202
+
 @api_app.route('/api/upload-document', methods=['POST'])
 def upload_document():
     try:
@@ -164,61 +451,95 @@ def upload_document():
         if not all([file_data, filename, subject, exam_type]):
             return jsonify({'error': 'Missing required fields'}), 400
         
+        job_id = uuid.uuid4().hex
+
+        # Keep the upload on disk until the job finishes so it can be resumed after a restart
         file_bytes = base64.b64decode(file_data)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        temp_file.write(file_bytes)
-        temp_file_path = temp_file.name
-        temp_file.close()
-        
-        text_by_page, images_by_page = parse_pdf(temp_file_path)
+        upload_path = os.path.join(UPLOAD_DIR, f"{job_id}.pdf")
+        with open(upload_path, "wb") as f:
+            f.write(file_bytes)
 
-        full_text = "\n".join(text_by_page)
+        return queue_ingestion(job_id, upload_path, filename, subject, exam_type)
 
-        documents = {}
-        document_id = f"{subject.lower().replace(' ', '')}_1"
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        metadata = {
-            "filename": filename,
-            "subject": subject,
-            "exam_type": exam_type,
-            "pages": len(text_by_page)
-        }
-        rag_system.add_document(document_id, full_text, metadata)
+@api_app.route('/api/upload-document/stream', methods=['POST'])
+def upload_document_stream():
+    """
+    Upload a PDF without base64 or buffering: the body is written to disk in chunks as it arrives.
 
-        documents[document_id] = {
-            "type": "pdf",
-            "name": filename,
-            "subject": subject,
-            "exam_type": exam_type,
-            "content": text_by_page,
-            "images": images_by_page,
-            "path": f"data/processed/{document_id}.json"
-        }
+    Accepts multipart/form-data with a "file" part and filename, subject and exam_type fields,
+    or a raw PDF body (e.g. application/pdf) with those fields as query parameters.
+    """
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES:
+        return jsonify({'error': f'Upload exceeds the {MAX_UPLOAD_BYTES} byte limit'}), 413
 
-        os.makedirs("data/processed", exist_ok=True)
-        with open(f"data/processed/{document_id}.json", "w") as f:
-            json.dump({
-                "type": "pdf",
-                "name": filename,
-                "subject": subject,
-                "exam_type": exam_type,
-                "content": text_by_page,
-                "images": images_by_page
-            }, f)
+    job_id = uuid.uuid4().hex
+    uploads = []
 
-        with open("data/documents_index.json", "w") as f:
-            json.dump(documents, f)
+    def stream_factory(*args, **kwargs):
+        upload = HashingUploadFile(os.path.join(UPLOAD_DIR, f"{job_id}_{len(uploads)}.part"))
+        uploads.append(upload)
+        return upload
 
-        os.unlink(temp_file_path)
+    try:
+        if request.mimetype == "multipart/form-data":
+            _, fields, files = parse_form_data(
+                request.environ, stream_factory=stream_factory, max_form_memory_size=UPLOAD_FORM_MEMORY
+            )
+            file = files.get("file")
+            upload = file.stream if file else None
+            filename = fields.get("filename") or (file.filename if file else None)
+        else:
+            fields = request.args
+            upload = stream_factory()
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                upload.write(chunk)
+            filename = fields.get("filename")
+
+        subject = fields.get("subject")
+        exam_type = fields.get("exam_type")
+
+        if upload is None or upload.size == 0 or not all([filename, subject, exam_type]):
+            return jsonify({'error': 'Missing required fields'}), 400
 
-        return jsonify({
-            'success': True,
-            'message': f'Document processed successfully! You can now generate questions for {subject}.',
-            'document_id': document_id
-        })
+        upload.close()
+        upload_path = os.path.join(UPLOAD_DIR, f"{job_id}.pdf")
+        os.replace(upload.path, upload_path)
+
+        return queue_ingestion(job_id, upload_path, filename, subject, exam_type, sha256=upload.sha256.hexdigest())
 
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Upload exceeds the {MAX_UPLOAD_BYTES} byte limit'}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        # Remove partial files and any extra file parts; the queued upload has already been moved
+        for part in uploads:
+            part.close()
+            if os.path.exists(part.path):
+                os.unlink(part.path)
+
+@api_app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'progress': job['progress'],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    })
     
 @api_app.route('/api/search-content', methods=['POST'])
 def search_content():
@@ -250,6 +571,53 @@ def search_content():
         print(f"API Error: {str(e)}")
         return jsonify({'error': str(e)}), 500
     
+@api_app.route('/api/questions/similar', methods=['POST'])
+def similar_questions():
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('questions'), list):
+            return jsonify({'error': 'questions list is required'}), 400
+
+        n_results = int(data.get('n_results', 1))
+        threshold = float(data.get('threshold', QUESTION_SIMILARITY_THRESHOLD))
+
+        neighbours = rag_system.find_similar_questions(data['questions'], n_results=n_results)
+
+        return jsonify({
+            'success': True,
+            'threshold': threshold,
+            'results': [
+                {
+                    'index': i,
+                    'neighbours': matches,
+                    'is_duplicate': bool(matches) and matches[0]['similarity'] >= threshold
+                }
+                for i, matches in enumerate(neighbours)
+            ]
+        })
+
+    except Exception as e:
+        print(f"API Error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@api_app.route('/api/questions/index', methods=['POST'])
+def index_questions():
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('questions'), list):
+            return jsonify({'error': 'questions list is required'}), 400
+
+        indexed = rag_system.index_questions(data['questions'])
+
+        return jsonify({
+            'success': True,
+            'indexed': indexed
+        })
+
+    except Exception as e:
+        print(f"API Error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @api_app.route('/api/documents-index')
 def get_index():
     with open("data/documents_index.json") as f:
@@ -390,4 +758,5 @@ def health_check():
 if __name__ == "__main__":
     cleanup_thread = threading.Thread(target=cleanup_old_conversations, daemon=True)
     cleanup_thread.start()
+    job_queue.start()
     api_app.run(host="0.0.0.0", port=5001, debug=False)
\ No newline at end of file
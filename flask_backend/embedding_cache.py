@@ -0,0 +1,105 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from array import array
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("data", "embedding_cache.db"))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that reuses stored vectors for text it has already embedded.
+
+    Vectors are kept in SQLite keyed by (embedding model, sha256 of the
+    text), so re-uploading a document only sends new or changed chunks to
+    the provider. Cache misses from one call are embedded in a single
+    request to the wrapped embeddings, or through the scheduler if one is
+    given.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, path: str = EMBEDDING_CACHE_PATH, scheduler=None):
+        self.embeddings = embeddings
+        self.model = model
+        self.scheduler = scheduler
+        self.path = path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes):
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({', '.join('?' * len(batch))})",
+                    [self.model] + batch
+                ).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = array("f", blob).tolist()
+        return found
+
+    def _store(self, entries):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model, text_hash, array("f", vector).tobytes()) for text_hash, vector in entries]
+            )
+            self._connection.commit()
+
+    def embed_documents(self, texts, progress_callback=None):
+        """
+        Embed texts, reusing cached vectors
+
+        Args:
+            texts (list): Texts to embed
+            progress_callback (callable): Called as progress_callback(done, total) over the texts being embedded
+
+        Returns:
+            list: One vector per text
+        """
+        hashes = [self.text_hash(text) for text in texts]
+        cached = self._lookup(hashes)
+
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached:
+                missing.setdefault(text_hash, text)
+
+        if missing:
+            if self.scheduler:
+                vectors = self.scheduler.embed(list(missing.values()), progress_callback)
+            else:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_entries = list(zip(missing.keys(), vectors))
+            self._store(new_entries)
+            cached.update(new_entries)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if texts:
+            print(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} chunks reused, {len(missing)} embedded")
+
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,146 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Inputs per embedding request, and a rough per-request token cap (1.33 tokens per word, as in the RAG code)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "200000"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+
+
+def _estimate_tokens(text):
+    return int(len(text.split()) * 1.33) + 1
+
+
+def _retry_after(error):
+    """Seconds the provider asked us to wait (retry-after-ms / retry-after headers), or None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def _is_retryable(error):
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    return name in ("RateLimitError", "APITimeoutError", "APIConnectionError", "Timeout", "ConnectionError")
+
+
+class EmbeddingScheduler:
+    """
+    Embed many texts with batched, concurrent requests to the provider.
+
+    Texts are grouped into batches of at most batch_size inputs and
+    max_batch_tokens estimated tokens, and up to max_concurrency batches are
+    in flight at once. On a 429 every worker pauses for the provider's
+    retry-after (or an exponential backoff with jitter) before retrying, so
+    the scheduler slows down as a whole instead of hammering the limit.
+    """
+
+    def __init__(self, embed_batch, batch_size=EMBEDDING_BATCH_SIZE, max_batch_tokens=EMBEDDING_BATCH_TOKENS,
+                 max_concurrency=EMBEDDING_MAX_CONCURRENCY, max_retries=EMBEDDING_MAX_RETRIES):
+        """
+        Args:
+            embed_batch (callable): Function embedding a list of texts in one provider request
+        """
+        self.embed_batch = embed_batch
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._pause_lock = threading.Lock()
+        self._paused_until = 0.0
+
+    def batches(self, texts):
+        """Index ranges (start, end) of the request batches for texts"""
+        ranges = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            text_tokens = _estimate_tokens(text)
+            if i > start and (i - start >= self.batch_size or tokens + text_tokens > self.max_batch_tokens):
+                ranges.append((start, i))
+                start, tokens = i, 0
+            tokens += text_tokens
+        if start < len(texts):
+            ranges.append((start, len(texts)))
+        return ranges
+
+    def _wait_for_pause(self):
+        while True:
+            with self._pause_lock:
+                delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _pause(self, seconds):
+        with self._pause_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _embed_with_retry(self, texts):
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_pause()
+            try:
+                return self.embed_batch(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+                print(f"Embedding request failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s")
+                if _status_code(e) == 429 or type(e).__name__ == "RateLimitError":
+                    self._pause(delay)
+                else:
+                    time.sleep(delay)
+
+    def embed(self, texts, progress_callback=None):
+        """
+        Embed texts, keeping input order
+
+        Args:
+            texts (list): Texts to embed
+            progress_callback (callable): Called as progress_callback(done, total) after each batch
+
+        Returns:
+            list: One vector per text
+        """
+        texts = list(texts)
+        vectors = [None] * len(texts)
+        ranges = self.batches(texts)
+        done = 0
+
+        if progress_callback:
+            progress_callback(0, len(texts))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(ranges) or 1))) as executor:
+            futures = {
+                executor.submit(self._embed_with_retry, texts[start:end]): (start, end)
+                for start, end in ranges
+            }
+            for future in as_completed(futures):
+                start, end = futures[future]
+                vectors[start:end] = future.result()
+                done += end - start
+                if progress_callback:
+                    progress_callback(done, len(texts))
+
+        return vectors
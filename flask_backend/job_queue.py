@@ -0,0 +1,177 @@
+import os
+import json
+import uuid
+import sqlite3
+import threading
+import traceback
+from datetime import datetime
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("data", "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Seconds an idle worker waits before checking the queue again (enqueue wakes workers immediately)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+
+
+class JobQueue:
+    """
+    Persistent background job queue backed by SQLite.
+
+    Jobs are stored with their payload, status (queued, running, succeeded,
+    failed), current stage, progress percentage, result and error, so their
+    state survives a restart; jobs that were running when the process
+    stopped are queued again on start(). A pool of worker threads claims
+    queued jobs in order and runs the handler registered for the job kind.
+    """
+
+    def __init__(self, handlers, path=JOB_DB_PATH, workers=JOB_WORKERS):
+        """
+        Args:
+            handlers (dict): Job kind -> handler(payload, report). report(stage, progress) updates
+                the job; the handler's return value is stored as the job result.
+        """
+        self.handlers = handlers
+        self.path = path
+        self.workers = workers
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._started = False
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, created_at)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self, kind, payload, job_id=None):
+        """
+        Add a job to the queue
+
+        Returns:
+            str: Job ID
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+        job_id = job_id or uuid.uuid4().hex
+        now = datetime.utcnow().isoformat()
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, status, stage, progress, payload, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', 'queued', 0, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), now, now)
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Current state of a job
+
+        Returns:
+            dict: Job fields (payload and result decoded), or None if the job does not exist
+        """
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _claim(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row:
+                now = datetime.utcnow().isoformat()
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', stage = 'starting', started_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (now, now, row["id"])
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(f"UPDATE jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+
+    def _run(self, row):
+        job_id = row["id"]
+
+        def report(stage, progress=None):
+            fields = {"stage": stage}
+            if progress is not None:
+                fields["progress"] = round(max(0.0, min(100.0, progress)), 1)
+            self._update(job_id, **fields)
+
+        try:
+            result = self.handlers[row["kind"]](json.loads(row["payload"]), report)
+            self._update(
+                job_id, status="succeeded", stage="done", progress=100.0,
+                result=json.dumps(result), finished_at=datetime.utcnow().isoformat()
+            )
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status="failed", error=str(e), finished_at=datetime.utcnow().isoformat())
+
+    def _worker(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                row = None
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(JOB_POLL_INTERVAL)
+                continue
+            self._run(row)
+
+    def start(self):
+        """Requeue jobs interrupted by a restart and start the worker threads (idempotent)"""
+        if self._started:
+            return
+        self._started = True
+
+        requeued = self._connection().execute(
+            "UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0, updated_at = ? WHERE status = 'running'",
+            (datetime.utcnow().isoformat(),)
+        ).rowcount
+        if requeued:
+            print(f"Requeued {requeued} interrupted jobs")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
@@ -0,0 +1,106 @@
+import json
+import random
+from difflib import SequenceMatcher
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+from utils import dedup
+from utils.dedup import MinHashLSHIndex, PersistentDedupIndex, DEDUP_SIMILARITY_THRESHOLD, normalize_question_text
+
+WORDS = (
+    "a block of mass kg slides down an inclined plane angle friction coefficient find the acceleration "
+    "velocity after seconds current through resistor ohm circuit battery voltage charge capacitor energy "
+    "stored wave frequency wavelength speed sound lens focal length image distance object height magnetic "
+    "field wire loop flux induced emf projectile launched horizontal range maximum height ideal gas pressure "
+    "volume temperature heat work done spring constant extension oscillation period pendulum"
+).split()
+
+
+def make_question(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(15, 30))]
+    numbers = [str(rng.randint(1, 99)) for _ in range(3)]
+    return " ".join(words[:5] + numbers[:1] + words[5:12] + numbers[1:2] + words[12:] + numbers[2:]) + "?"
+
+
+def perturb(text, rng, edits):
+    words = text.split()
+    for _ in range(edits):
+        position = rng.randrange(len(words))
+        operation = rng.choice(("replace", "insert", "delete"))
+        if operation == "replace":
+            words[position] = rng.choice(WORDS)
+        elif operation == "insert":
+            words.insert(position, rng.choice(WORDS))
+        elif len(words) > 5:
+            del words[position]
+    return " ".join(words)
+
+
+def similar_pairs(count, low=DEDUP_SIMILARITY_THRESHOLD, high=1.0, seed=7):
+    """Pairs of distinct questions whose normalized SequenceMatcher ratio falls in [low, high)"""
+    rng = random.Random(seed)
+    pairs = []
+    while len(pairs) < count:
+        original = make_question(rng)
+        variant = perturb(original, rng, rng.randint(1, 8))
+        ratio = SequenceMatcher(None, normalize_question_text(variant), normalize_question_text(original)).ratio()
+        if variant != original and low <= ratio < high:
+            pairs.append((original, variant))
+    return pairs
+
+
+def recall(pairs):
+    index = MinHashLSHIndex().add_all(original for original, _ in pairs)
+    return sum(index.find_duplicate(variant) is not None for _, variant in pairs) / len(pairs)
+
+
+def test_lsh_recall_on_pairs_above_threshold():
+    assert recall(similar_pairs(400)) >= 0.98
+
+
+def test_lsh_recall_near_threshold():
+    # Pairs just above the threshold have the lowest shingle Jaccard and are the ones LSH can miss
+    assert recall(similar_pairs(400, high=0.85)) >= 0.95
+
+
+def test_remove_drops_entry_from_buckets():
+    index = MinHashLSHIndex()
+    text = "A ball is thrown vertically upward with a speed of 20 m/s. Find the maximum height."
+    entry_id = index.add(text)
+    other_id = index.add("Two resistors of 4 ohm and 6 ohm are connected in series to a 10 V battery.")
+
+    index.remove(entry_id)
+
+    assert len(index) == 1
+    assert index.find_duplicate(text) is None
+    assert entry_id not in index.candidates(normalize_question_text(text))
+    assert all(entry_id not in bucket for buckets in index._buckets for bucket in buckets.values())
+    assert all(bucket for buckets in index._buckets for bucket in buckets.values())
+    assert other_id in index.candidates(normalize_question_text(
+        "Two resistors of 4 ohm and 6 ohm are connected in series to a 10 V battery."
+    ))
+
+
+def test_persistent_index_reloads_without_rehashing(tmp_path, monkeypatch):
+    generated_dir = tmp_path / "generated"
+    generated_dir.mkdir()
+    questions = [{"id": f"q{i + 1}", "question": make_question(random.Random(i))} for i in range(20)]
+    (generated_dir / "physics_1_questions.json").write_text(json.dumps({"questions": questions}))
+    index_path = str(tmp_path / "dedup_index.db")
+
+    PersistentDedupIndex(str(generated_dir), index_path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("stored value was recomputed")
+
+    monkeypatch.setattr(MinHashLSHIndex, "signature", fail)
+    monkeypatch.setattr(dedup, "normalize_question_text", fail)
+    reloaded = PersistentDedupIndex(str(generated_dir), index_path)
+
+    monkeypatch.undo()
+
+    assert len(reloaded.lsh) == len(questions)
+    assert reloaded.find_duplicate({"question": questions[3]["question"]}) is not None
@@ -0,0 +1,109 @@
+import json
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("google.generativeai")
+pytest.importorskip("together")
+pytest.importorskip("openai")
+
+from utils import llm_cache
+from utils import model_interface
+
+CONTENT = {1: "Mercury is the closest planet to the sun. Venus is the hottest planet."}
+QUESTIONS = [
+    {"question": text, "options": ["A", "B", "C", "D"], "correct_answer": "A", "difficulty": "easy"}
+    for text in (
+        "Which planet is closest to the sun?",
+        "Why is Venus hotter than Mercury despite being farther away?",
+        "How many moons does Mars have?",
+    )
+]
+TEXTS = [question["question"] for question in QUESTIONS]
+FULL_RESPONSE = "```json\n" + json.dumps({"questions": QUESTIONS}) + "\n```"
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+
+def fake_model(monkeypatch, stream_chunks, full_text=FULL_RESPONSE):
+    """Replace the Gemma model: streaming calls yield stream_chunks, non-streaming calls return full_text"""
+    class FakeModel:
+        calls = 0
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def generate_content(self, prompt, stream=False):
+            FakeModel.calls += 1
+            if stream:
+                return [FakeChunk(text) for text in stream_chunks]
+            return FakeChunk(full_text)
+
+    monkeypatch.setattr(model_interface.genai, "GenerativeModel", FakeModel)
+    return FakeModel
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = llm_cache.LLMResponseCache(cache_dir=str(tmp_path), enabled=True)
+    monkeypatch.setattr(llm_cache, "response_cache", cache)
+    monkeypatch.setattr(model_interface, "response_cache", cache)
+    return cache
+
+
+def stream(use_cache=True):
+    return list(model_interface.generate_questions_stream(
+        CONTENT, "Astronomy", 3, {"easy": 3, "medium": 0, "hard": 0}, use_cache=use_cache, token_budget=0
+    ))
+
+
+def generate(use_cache=True):
+    return model_interface.generate_questions(
+        CONTENT, "Astronomy", 3, {"easy": 3, "medium": 0, "hard": 0}, use_cache=use_cache, token_budget=0, shard_pages=0
+    )
+
+
+def test_truncated_stream_is_not_cached(cache, monkeypatch):
+    # Cut the response off after the second question, as when max_output_tokens is reached
+    cut = FULL_RESPONSE.index(json.dumps(QUESTIONS[2])[:30])
+    fake_model(monkeypatch, [FULL_RESPONSE[:cut // 2], FULL_RESPONSE[cut // 2:cut]])
+
+    streamed = stream()
+    assert [q["question"] for q in streamed] == TEXTS[:2]
+
+    questions = generate()
+    assert [q["question"] for q in questions] == TEXTS
+
+
+def test_complete_stream_is_cached_for_generate_questions(cache, monkeypatch):
+    model = fake_model(monkeypatch, [FULL_RESPONSE], full_text="")
+
+    assert len(stream()) == 3
+    assert len(generate()) == 3
+    assert model.calls == 1
+
+
+def test_questions_completed_in_one_chunk_get_distinct_ids(cache, monkeypatch):
+    fake_model(monkeypatch, [FULL_RESPONSE])
+
+    assert [q["id"] for q in stream(use_cache=False)] == ["q1", "q2", "q3"]
+
+    # The cached replay delivers the whole response as a single chunk
+    stream()
+    assert [q["id"] for q in stream()] == ["q1", "q2", "q3"]
+
+
+def test_sharded_stream_merges_shards(cache, monkeypatch):
+    fake_model(monkeypatch, [FULL_RESPONSE])
+    content = {page: f"Page {page} about the planets of the solar system." for page in range(1, 5)}
+
+    questions = list(model_interface.generate_questions_stream(
+        content, "Astronomy", 6, {"easy": 6, "medium": 0, "hard": 0}, use_cache=False, token_budget=0, shard_pages=2
+    ))
+
+    # Both shards return the same three questions; the copies are dropped as cross-shard duplicates
+    assert [q["id"] for q in questions] == ["q1", "q2", "q3"]
+    assert sorted(q["question"] for q in questions) == sorted(TEXTS)
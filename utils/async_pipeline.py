@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+from utils.llm_client import LLM_MAX_IN_FLIGHT
+from utils.dedup import MinHashLSHIndex, dedup_service
+from utils.model_interface import (
+    find_semantic_duplicates,
+    generate_questions_stream,
+    is_verifiable_question,
+    solve_all_questions,
+    verify_all_questions
+)
+
+# How long a stage waits after its first queued item for more items to batch with it
+PIPELINE_BATCH_LINGER = float(os.getenv("PIPELINE_BATCH_LINGER", "1.0"))
+# Unique questions collected before a batch is solved and verified (the last batch may be smaller)
+PIPELINE_SOLVE_BATCH = int(os.getenv("PIPELINE_SOLVE_BATCH", "5"))
+
+_DONE = object()
+
+
+async def _drain_batch(queue, linger=PIPELINE_BATCH_LINGER):
+    """
+    Wait for at least one item, then keep collecting items for up to `linger` seconds
+
+    Returns:
+        tuple: (list of items, True if the end-of-stream marker was seen)
+    """
+    first = await queue.get()
+    if first is _DONE:
+        return [], True
+
+    items = [first]
+    deadline = time.monotonic() + linger
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout=remaining)
+        except asyncio.TimeoutError:
+            break
+        if item is _DONE:
+            return items, True
+        items.append(item)
+
+    return items, False
+
+
+async def _generated_questions(content, subject, num_questions, difficulty_distribution, conversation_data=None, use_cache=True):
+    """Yield questions as the streaming generator produces them"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for question in generate_questions_stream(
+                content, subject, num_questions, difficulty_distribution,
+                conversation_data=conversation_data, use_cache=use_cache
+            ):
+                loop.call_soon_threadsafe(queue.put_nowait, question)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    producer = asyncio.create_task(asyncio.to_thread(produce))
+    while True:
+        question = await queue.get()
+        if question is _DONE:
+            break
+        yield question
+    await producer
+
+
+async def _dedup_stage(source, existing_index_task, out_queue, order):
+    """
+    Filter duplicates as questions arrive and forward unique ones for verification,
+    recording each accepted question's position in `order`
+    """
+    try:
+        existing_index = await existing_index_task
+        accepted_index = MinHashLSHIndex()
+
+        async for question in source:
+            if accepted_index.find_duplicate(question) or await asyncio.to_thread(dedup_service.is_duplicate, question, existing_index):
+                print(f"Filtered out duplicate: {question.get('question', '')[:50]}...")
+                continue
+            if not is_verifiable_question(question):
+                continue
+            accepted_index.add(question)
+            order[question.get('id')] = len(order)
+            await out_queue.put(question)
+    finally:
+        await out_queue.put(_DONE)
+
+
+async def _verify_stage(in_queue, out_queue, subject, content, max_in_flight, solve_batch=PIPELINE_SOLVE_BATCH):
+    """
+    Collect unique questions into batches of up to solve_batch, drop semantic duplicates,
+    solve each batch with one request and verify it with verify_all_questions, so
+    VERIFY_MODE and the shared LLM rate limit apply as in the synchronous path
+    """
+    # One batch verifies at a time, so at most max_in_flight verification requests are in flight overall
+    verify_lock = asyncio.Lock()
+    tasks = []
+
+    async def process(batch):
+        semantic_duplicates = await asyncio.to_thread(find_semantic_duplicates, batch)
+        if semantic_duplicates is not None:
+            batch = [question for question, is_duplicate in zip(batch, semantic_duplicates) if not is_duplicate]
+        if not batch:
+            return
+        # The solve prompt carries the whole content, so it is sent once per batch rather than per question
+        solved_answers = await asyncio.to_thread(solve_all_questions, batch, subject, content)
+        async with verify_lock:
+            verified = await asyncio.to_thread(
+                verify_all_questions, batch, solved_answers, subject, content, max_workers=max_in_flight
+            )
+        for question in verified:
+            await out_queue.put(question)
+
+    try:
+        pending = []
+        done = False
+        while not done:
+            batch, done = await _drain_batch(in_queue)
+            pending.extend(batch)
+            if pending and (len(pending) >= solve_batch or done):
+                tasks.append(asyncio.create_task(process(pending)))
+                pending = []
+
+        await asyncio.gather(*tasks)
+    finally:
+        await out_queue.put(_DONE)
+
+
+async def _collect_stage(in_queue):
+    """Gather verified questions until the verification stage finishes"""
+    verified_questions = []
+    while True:
+        question = await in_queue.get()
+        if question is _DONE:
+            return verified_questions
+        verified_questions.append(question)
+
+
+async def generate_verified_questions_async(content, subject, num_questions, difficulty_distribution,
+                                            conversation_data=None, use_cache=True, max_in_flight=LLM_MAX_IN_FLIGHT):
+    """
+    Asyncio version of generate_questions_with_duplicate_check where the stages overlap:
+    questions are streamed from the model, local duplicate filtering starts as each one
+    arrives, and each batch of unique questions goes through the semantic duplicate check,
+    one solve request and verification while later questions are still being generated.
+    Content longer than QUESTION_SHARD_PAGES is streamed shard by shard in parallel.
+
+    Args:
+        content (dict): Content keyed by chapter/page number
+        subject (str): Subject area
+        num_questions (int): Number of questions to generate
+        difficulty_distribution (dict): Distribution of difficulty levels
+        conversation_data (dict): Optional conversation context
+        use_cache (bool): Set to False to sample new questions instead of replaying a cached response
+        max_in_flight (int): Maximum concurrent verification requests (within VERIFY_MODE and the shared rate limit)
+
+    Returns:
+        list: Verified questions, in generation order
+    """
+    existing_index_task = asyncio.create_task(asyncio.to_thread(lambda: dedup_service.index))
+    source = _generated_questions(content, subject, num_questions, difficulty_distribution, conversation_data, use_cache)
+
+    order = {}
+    verify_queue = asyncio.Queue()
+    verified_queue = asyncio.Queue()
+
+    _, _, verified_questions = await asyncio.gather(
+        _dedup_stage(source, existing_index_task, verify_queue, order),
+        _verify_stage(verify_queue, verified_queue, subject, content, max_in_flight),
+        _collect_stage(verified_queue)
+    )
+
+    print(f"Pipeline verified {len(verified_questions)} of {len(order)} locally unique questions.")
+    print(f"Duplicate check stats: {dedup_service.stats()}")
+
+    verified_questions.sort(key=lambda question: order.get(question.get('id'), len(order)))
+    return verified_questions
+
+
+def run_question_pipeline(content, subject, num_questions, difficulty_distribution, conversation_data=None, use_cache=True):
+    """Run the async pipeline from synchronous code (e.g. the Streamlit app)"""
+    return asyncio.run(generate_verified_questions_async(
+        content, subject, num_questions, difficulty_distribution,
+        conversation_data=conversation_data, use_cache=use_cache
+    ))
@@ -0,0 +1,123 @@
+import os
+import re
+import math
+from collections import Counter
+
+CONTENT_TOKEN_BUDGET = int(os.getenv("CONTENT_TOKEN_BUDGET", "60000"))
+CONTENT_CHUNK_TOKENS = int(os.getenv("CONTENT_CHUNK_TOKENS", "600"))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "which", "why",
+    "with", "you", "i", "we", "can", "do", "does", "about", "me", "my", "your"
+}
+
+# Fractional part of the golden ratio, used to spread equally ranked chunks across the document
+_GOLDEN_FRACTION = (math.sqrt(5) - 1) / 2
+
+
+def estimate_tokens(text):
+    """Rough token estimate, same heuristic as the RAG backend (1.33 tokens per word)"""
+    return int(len(text.split()) * 1.33) + 1
+
+
+def _terms(text):
+    return [term for term in re.findall(r"[a-z0-9]+", text.lower()) if term not in STOPWORDS and len(term) > 1]
+
+
+def split_into_chunks(content, max_chunk_tokens=CONTENT_CHUNK_TOKENS):
+    """
+    Split content into chunks of roughly max_chunk_tokens tokens
+
+    Args:
+        content (dict): Text keyed by page/chapter number
+
+    Returns:
+        list: (page key, chunk text, estimated tokens) tuples in document order
+    """
+    max_words = max(1, int(max_chunk_tokens / 1.33))
+    chunks = []
+    for key, text in content.items():
+        words = str(text).split()
+        if not words:
+            continue
+        for start in range(0, len(words), max_words):
+            chunk_text = " ".join(words[start:start + max_words])
+            chunks.append((key, chunk_text, estimate_tokens(chunk_text)))
+    return chunks
+
+
+def pack_content(content, query="", token_budget=CONTENT_TOKEN_BUDGET, max_chunk_tokens=CONTENT_CHUNK_TOKENS):
+    """
+    Fit content into a token budget, keeping the chunks most relevant to the query
+
+    Chunks are scored with TF-IDF overlap against the query terms. When the
+    query gives no signal, chunks are picked evenly across the document
+    instead of just taking the first pages. Selected chunks are put back in
+    document order under their original page keys.
+
+    Args:
+        content (dict): Text keyed by page/chapter number
+        query (str): Topic/subject text used to rank chunks
+        token_budget (int): Maximum estimated tokens to keep (0 or None disables packing)
+        max_chunk_tokens (int): Chunk size used for ranking
+
+    Returns:
+        tuple: (packed content dict, report dict with total/kept/dropped token and chunk counts)
+    """
+    total_tokens = sum(estimate_tokens(str(text)) for text in content.values())
+    report = {
+        "total_tokens": total_tokens,
+        "kept_tokens": total_tokens,
+        "dropped_tokens": 0,
+        "total_chunks": None,
+        "dropped_chunks": 0,
+        "dropped_pages": 0
+    }
+
+    if not token_budget or total_tokens <= token_budget:
+        return content, report
+
+    chunks = split_into_chunks(content, max_chunk_tokens)
+    chunk_terms = [Counter(_terms(text)) for _, text, _ in chunks]
+    query_terms = set(_terms(query))
+
+    document_frequency = Counter()
+    for terms in chunk_terms:
+        document_frequency.update(terms.keys())
+
+    def score(index):
+        terms = chunk_terms[index]
+        length = sum(terms.values()) or 1
+        return sum(
+            (terms[term] / length) * math.log(1 + len(chunks) / document_frequency[term])
+            for term in query_terms if term in terms
+        )
+
+    ranked = sorted(
+        range(len(chunks)),
+        key=lambda index: (-score(index), (index * _GOLDEN_FRACTION) % 1)
+    )
+
+    selected = set()
+    kept_tokens = 0
+    for index in ranked:
+        tokens = chunks[index][2]
+        if kept_tokens + tokens > token_budget:
+            continue
+        selected.add(index)
+        kept_tokens += tokens
+
+    packed = {}
+    for index in sorted(selected):
+        key, text, _ = chunks[index]
+        packed[key] = f"{packed[key]} {text}" if key in packed else text
+
+    report.update({
+        "kept_tokens": kept_tokens,
+        "dropped_tokens": total_tokens - kept_tokens,
+        "total_chunks": len(chunks),
+        "dropped_chunks": len(chunks) - len(selected),
+        "dropped_pages": len(content) - len(packed)
+    })
+    return packed, report
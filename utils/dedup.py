@@ -0,0 +1,840 @@
+import os
+import re
+import json
+import zlib
+import sqlite3
+import hashlib
+import threading
+import time
+from collections import defaultdict, Counter
+from difflib import SequenceMatcher
+import numpy as np
+from scipy import sparse
+
+DEDUP_SIMILARITY_THRESHOLD = 0.8
+
+# MinHash/LSH parameters: 32 bands of 4 rows put the LSH candidate threshold at a
+# shingle Jaccard of roughly (1/32) ** (1/4) ~= 0.42, below the Jaccard of most
+# question pairs whose SequenceMatcher ratio reaches 0.8. On synthetic question pairs
+# (tests/test_dedup.py) recall is ~0.99 overall and ~0.97 for pairs with a ratio
+# between 0.8 and 0.85; every candidate is still confirmed with the exact ratio.
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32
+SHINGLE_SIZE = 4
+
+_MERSENNE_PRIME = np.uint64(4294967311)
+
+# Character n-gram size and the TF-IDF cosine above which pairs from the batch similarity
+# matrix are confirmed with the exact SequenceMatcher ratio
+MATRIX_NGRAM_SIZE = 3
+MATRIX_CANDIDATE_COSINE = float(os.getenv("DEDUP_MATRIX_CANDIDATE_COSINE", "0.6"))
+
+GENERATED_QUESTIONS_DIR = os.path.join("data", "generated")
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", os.path.join("data", "dedup_index.db"))
+# Minimum seconds between re-checking data/generated for files written outside this process
+DEDUP_INDEX_REFRESH_INTERVAL = float(os.getenv("DEDUP_INDEX_REFRESH_INTERVAL", "30"))
+
+
+# Generated question IDs are positional ("q1", "q2", ...) and repeat across files, so only
+# other IDs are treated as identifying a question
+_POSITIONAL_ID = re.compile(r"^q\d+$")
+
+_LATEX_REPLACEMENTS = [
+    (re.compile(r"\\(?:text|mathrm|mathbf|mathit|operatorname)\s*\{([^{}]*)\}"), r"\1"),
+    (re.compile(r"\\[dt]?frac\s*\{([^{}]*)\}\s*\{([^{}]*)\}"), r"\1/\2"),
+    (re.compile(r"\\(?:left|right)\b"), ""),
+    (re.compile(r"\\(?:cdot|times)\b"), "*"),
+    (re.compile(r"\^\s*\{?\\circ\}?|\\degree\b|°"), " deg"),
+    (re.compile(r"\\[,;:! ]|~"), " "),
+    (re.compile(r"\\[()\[\]]|\$"), " "),
+    (re.compile(r"\\([a-z]+)"), r"\1"),
+    (re.compile(r"[{}]"), ""),
+]
+
+_UNIT_REPLACEMENTS = [
+    (re.compile(r"\b(?:kilometres?|kilometers?)\b"), "km"),
+    (re.compile(r"\b(?:centimetres?|centimeters?)\b"), "cm"),
+    (re.compile(r"\b(?:millimetres?|millimeters?)\b"), "mm"),
+    (re.compile(r"\b(?:metres?|meters?)\b"), "m"),
+    (re.compile(r"\b(?:kilograms?|kgs)\b"), "kg"),
+    (re.compile(r"\b(?:grams?|gms?)\b"), "g"),
+    (re.compile(r"\b(?:seconds?|secs?)\b"), "s"),
+    (re.compile(r"\b(?:hours?|hrs?)\b"), "h"),
+    (re.compile(r"\b(?:degrees?)\b"), "deg"),
+    (re.compile(r"\b(?:newtons?)\b"), "n"),
+    (re.compile(r"\b(?:joules?)\b"), "j"),
+    (re.compile(r"\b(?:watts?)\b"), "w"),
+    (re.compile(r"\s*(/|\*|\^)\s*"), r"\1"),
+    (re.compile(r"(\d)\s*(km|cm|mm|m|kg|g|s|h|deg|n|j|w)\b"), r"\1 \2"),
+]
+
+
+def normalize_question_text(text):
+    """
+    Normalize question text before similarity comparison
+
+    Lowercases, strips LaTeX markup (math delimiters, \\text{}, \\frac{a}{b} -> a/b,
+    \\cdot/\\times -> *), spells units one way ("5 metres" and "5m" both become
+    "5 m") and collapses whitespace, so formatting differences between
+    generations do not hide duplicates.
+    """
+    text = str(text or "").lower()
+    for pattern, replacement in _LATEX_REPLACEMENTS + _UNIT_REPLACEMENTS:
+        text = pattern.sub(replacement, text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def identifying_id(question):
+    """Question ID if it identifies the question across files, else None"""
+    question_id = question.get('id') if isinstance(question, dict) else None
+    if not question_id or _POSITIONAL_ID.match(str(question_id)):
+        return None
+    return str(question_id)
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Set of character shingles of the given size"""
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _ngram_matrix(texts, size=MATRIX_NGRAM_SIZE):
+    """L2-normalized character n-gram TF-IDF matrix (rows follow texts)"""
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for row, text in enumerate(texts):
+        grams = {}
+        for gram in (text[i:i + size] for i in range(max(1, len(text) - size + 1))):
+            col = vocabulary.setdefault(gram, len(vocabulary))
+            grams[col] = grams.get(col, 0) + 1
+        rows.extend([row] * len(grams))
+        cols.extend(grams.keys())
+        counts.extend(grams.values())
+
+    matrix = sparse.csr_matrix(
+        (np.asarray(counts, dtype=np.float32), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+        shape=(len(texts), max(1, len(vocabulary)))
+    )
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1
+    matrix = matrix.multiply(idf).tocsr()
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+def batch_duplicate_matches(new_texts, existing_texts=(), threshold=DEDUP_SIMILARITY_THRESHOLD,
+                            candidate_cosine=MATRIX_CANDIDATE_COSINE):
+    """
+    Find duplicates for a whole batch with sparse matrix products
+
+    All texts are vectorized once into a shared character n-gram TF-IDF
+    space. The new x existing and new x new cosine matrices are computed in
+    one sparse product each, and only pairs above `candidate_cosine` are
+    confirmed with the SequenceMatcher ratio, so `threshold` keeps the same
+    meaning as the pairwise check. A new text also counts as a duplicate of
+    an earlier, non-duplicate text in the same batch.
+
+    Args:
+        new_texts (list): Candidate question texts
+        existing_texts (list): Question texts already in the corpus
+        threshold (float): SequenceMatcher ratio for a duplicate
+        candidate_cosine (float): Minimum n-gram cosine for a pair to be confirmed
+
+    Returns:
+        list: Per new text, None or a (source, index, similarity) tuple where source is
+        "existing" or "batch" and index points into existing_texts or new_texts
+    """
+    new_texts = [normalize_question_text(text) for text in new_texts]
+    existing_texts = [normalize_question_text(text) for text in existing_texts]
+    matches = [None] * len(new_texts)
+    if not new_texts:
+        return matches
+
+    matrix = _ngram_matrix(new_texts + existing_texts)
+    new_matrix = matrix[:len(new_texts)]
+
+    def confirmed(text, candidates, texts):
+        for col, _ in sorted(candidates, key=lambda candidate: -candidate[1]):
+            other = texts[col]
+            if not other:
+                continue
+            matcher = SequenceMatcher(None, text, other)
+            if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+                continue
+            similarity = matcher.ratio()
+            if similarity >= threshold:
+                return int(col), similarity
+        return None
+
+    if existing_texts:
+        existing_scores = new_matrix.dot(matrix[len(new_texts):].T).tocsr()
+        for row, text in enumerate(new_texts):
+            if not text:
+                continue
+            start, end = existing_scores.indptr[row], existing_scores.indptr[row + 1]
+            candidates = [
+                (col, score) for col, score in zip(existing_scores.indices[start:end], existing_scores.data[start:end])
+                if score >= candidate_cosine
+            ]
+            match = confirmed(text, candidates, existing_texts)
+            if match:
+                matches[row] = ("existing",) + match
+
+    batch_scores = sparse.triu(new_matrix.dot(new_matrix.T), k=1).tocsc()
+    for col, text in enumerate(new_texts):
+        if not text or matches[col]:
+            continue
+        start, end = batch_scores.indptr[col], batch_scores.indptr[col + 1]
+        candidates = [
+            (row, score) for row, score in zip(batch_scores.indices[start:end], batch_scores.data[start:end])
+            if score >= candidate_cosine and matches[row] is None
+        ]
+        match = confirmed(text, candidates, new_texts)
+        if match:
+            matches[col] = ("batch",) + match
+
+    return matches
+
+
+class MinHashLSHIndex:
+    """
+    Near-duplicate index over question text.
+
+    Each question is reduced to a MinHash signature of its character
+    shingles and bucketed by LSH bands, so a lookup only compares against
+    questions that share at least one band instead of the whole corpus.
+    Candidates are confirmed with the same SequenceMatcher ratio and
+    threshold the pairwise check uses, so the results keep the 0.8 meaning.
+    """
+
+    def __init__(self, threshold=DEDUP_SIMILARITY_THRESHOLD, num_perm=MINHASH_PERMUTATIONS, bands=LSH_BANDS,
+                 shingle_size=SHINGLE_SIZE, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2 ** 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 2 ** 31, size=num_perm).astype(np.uint64)
+
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+        self._texts = []
+        self._items = []
+        self._signatures = []
+        self._removed = 0
+
+    def __len__(self):
+        return len(self._texts) - self._removed
+
+    @property
+    def signature_params(self):
+        """
+        Everything a stored signature and normalized text depend on (MinHash parameters and the
+        normalization rules); values saved under different parameters must be recomputed
+        """
+        rules = zlib.crc32(repr([pattern.pattern for pattern, _ in _LATEX_REPLACEMENTS + _UNIT_REPLACEMENTS]).encode("utf-8"))
+        return f"minhash:{self.num_perm}:{self.bands}:{self.shingle_size}:{self.seed}:{rules}"
+
+    def signature(self, text):
+        """MinHash signature of normalized text"""
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text, self.shingle_size)),
+            dtype=np.uint64
+        )
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, question, signature=None, text=None):
+        """
+        Add a question (dict or text) to the index
+
+        Args:
+            signature (np.ndarray): Previously computed signature of the question, to skip hashing
+            text (str): Previously normalized question text, to skip normalization
+
+        Returns:
+            int: Entry ID of the added question, or None if it has no text
+        """
+        if text is None:
+            text = normalize_question_text(question.get('question', '') if isinstance(question, dict) else question)
+        if not text:
+            return None
+        if signature is None:
+            signature = self.signature(text)
+
+        entry_id = len(self._texts)
+        self._texts.append(text)
+        self._items.append(question)
+        self._signatures.append(signature)
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band][key].append(entry_id)
+        return entry_id
+
+    def add_all(self, questions):
+        for question in questions:
+            self.add(question)
+        return self
+
+    def remove(self, entry_id):
+        """Remove an entry and drop it from its LSH buckets"""
+        if 0 <= entry_id < len(self._texts) and self._texts[entry_id] is not None:
+            for band, key in enumerate(self._band_keys(self._signatures[entry_id])):
+                bucket = self._buckets[band].get(key)
+                if bucket is None:
+                    continue
+                bucket.remove(entry_id)
+                if not bucket:
+                    del self._buckets[band][key]
+            self._texts[entry_id] = None
+            self._items[entry_id] = None
+            self._signatures[entry_id] = None
+            self._removed += 1
+
+    def candidates(self, text):
+        """Entry IDs sharing at least one LSH band with the normalized text"""
+        found = set()
+        for band, key in enumerate(self._band_keys(self.signature(text))):
+            found.update(self._buckets[band].get(key, ()))
+        return found
+
+    def find_duplicate(self, question):
+        """
+        Find an indexed question at least `threshold` similar to the given one
+
+        Returns:
+            tuple: (matching question, similarity), or None if there is no duplicate
+        """
+        text = normalize_question_text(question.get('question', '') if isinstance(question, dict) else question)
+        if not text:
+            return None
+
+        for entry_id in sorted(self.candidates(text)):
+            existing_text = self._texts[entry_id]
+            if existing_text is None:
+                continue
+            matcher = SequenceMatcher(None, text, existing_text)
+            if matcher.real_quick_ratio() < self.threshold or matcher.quick_ratio() < self.threshold:
+                continue
+            similarity = matcher.ratio()
+            if similarity >= self.threshold:
+                return self._items[entry_id], similarity
+        return None
+
+
+def is_generated_questions_file(filename):
+    return filename.endswith("_questions.json") or filename.endswith("_questions_with_diagrams.json")
+
+
+def _file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PersistentDedupIndex:
+    """
+    Duplicate-check corpus for data/generated, persisted between runs.
+
+    The manifest is a SQLite database with one row per generated questions
+    file (mtime, size, sha256) and one row per question (id, text, normalized
+    text and MinHash signature, so LSH buckets are rebuilt on start without
+    normalizing or hashing again). On
+    load only files whose mtime or size changed are checksummed, and only
+    files whose checksum changed are parsed again, so the cost no longer
+    grows with the number of files ever generated. Saves made through
+    record_file() rewrite only that file's rows.
+    """
+
+    def __init__(self, generated_dir=GENERATED_QUESTIONS_DIR, index_path=DEDUP_INDEX_PATH,
+                 refresh_interval=DEDUP_INDEX_REFRESH_INTERVAL):
+        self.generated_dir = generated_dir
+        self.index_path = index_path
+        self.refresh_interval = refresh_interval
+        self.lsh = MinHashLSHIndex()
+        self._files = {}
+        self._signatures = {}
+        self._normalized = {}
+        self._entry_ids = {}
+        self._question_ids = Counter()
+        self._lock = threading.RLock()
+        self._last_refresh = None
+        self._db = None
+
+        self._load_manifest()
+        self.refresh(force=True)
+
+    def _connection(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "filename TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, sha256 TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS questions ("
+                "filename TEXT NOT NULL, position INTEGER NOT NULL, question_id TEXT, question TEXT NOT NULL, "
+                "normalized TEXT, signature BLOB, PRIMARY KEY (filename, position)) WITHOUT ROWID"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(questions)")]
+            for column, column_type in (("normalized", "TEXT"), ("signature", "BLOB")):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE questions ADD COLUMN {column} {column_type}")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.commit()
+        return self._db
+
+    def _load_manifest(self):
+        try:
+            connection = self._connection()
+            files = connection.execute("SELECT filename, mtime, size, sha256 FROM files").fetchall()
+            rows = connection.execute(
+                "SELECT filename, question_id, question, normalized, signature FROM questions ORDER BY filename, position"
+            ).fetchall()
+            params = connection.execute("SELECT value FROM meta WHERE key = 'signature_params'").fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: ignoring unreadable dedup index {self.index_path}: {e}")
+            return
+
+        # Values saved with other MinHash parameters or normalization rules cannot be reused
+        reuse_signatures = params is not None and params[0] == self.lsh.signature_params
+
+        questions = defaultdict(list)
+        precomputed = defaultdict(list)
+        for filename, question_id, question, normalized, signature in rows:
+            questions[filename].append({"id": question_id, "question": question})
+            if reuse_signatures and normalized == "":
+                precomputed[filename].append(("", None))
+            elif reuse_signatures and normalized is not None and signature is not None:
+                precomputed[filename].append((normalized, np.frombuffer(signature, dtype=np.uint64)))
+            else:
+                precomputed[filename].append(None)
+
+        stale = []
+        for filename, mtime, size, sha256 in files:
+            file_precomputed = precomputed.get(filename, [])
+            self._set_entry(filename, {
+                "mtime": mtime, "size": size, "sha256": sha256, "questions": questions.get(filename, [])
+            }, file_precomputed)
+            if any(value is None for value in file_precomputed):
+                stale.append(filename)
+
+        if not reuse_signatures:
+            try:
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('signature_params', ?)",
+                        (self.lsh.signature_params,)
+                    )
+            except sqlite3.Error as e:
+                print(f"Warning: could not write dedup index: {e}")
+        # Save values that had to be computed so the next start can skip them
+        for filename in stale:
+            self._save_entry(filename)
+
+    def _save_entry(self, filename):
+        """Write one file's manifest rows, leaving every other file untouched"""
+        entry = self._files.get(filename)
+        signatures = self._signatures.get(filename, [])
+        normalized = self._normalized.get(filename, [])
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute("DELETE FROM questions WHERE filename = ?", (filename,))
+                if entry is None:
+                    connection.execute("DELETE FROM files WHERE filename = ?", (filename,))
+                    return
+                connection.execute(
+                    "INSERT OR REPLACE INTO files (filename, mtime, size, sha256) VALUES (?, ?, ?, ?)",
+                    (filename, entry["mtime"], entry["size"], entry["sha256"])
+                )
+                connection.executemany(
+                    "INSERT INTO questions (filename, position, question_id, question, normalized, signature) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            filename, position, question.get("id"), question.get("question", ""), text,
+                            signature.tobytes() if signature is not None else None
+                        )
+                        for position, (question, text, signature)
+                        in enumerate(zip(entry.get("questions", []), normalized, signatures))
+                    ]
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: could not write dedup index: {e}")
+
+    def _save_file_stat(self, filename):
+        entry = self._files[filename]
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "UPDATE files SET mtime = ?, size = ? WHERE filename = ?", (entry["mtime"], entry["size"], filename)
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: could not write dedup index: {e}")
+
+    def _set_entry(self, filename, entry, precomputed=None):
+        """
+        Index a file's questions
+
+        Args:
+            precomputed (list): Stored (normalized text, signature) or None per question; missing ones are computed
+        """
+        self._drop_entry(filename)
+        questions = entry.get("questions", [])
+        precomputed = precomputed or []
+
+        normalized, signatures, entry_ids = [], [], []
+        for position, question in enumerate(questions):
+            if position < len(precomputed) and precomputed[position] is not None:
+                text, signature = precomputed[position]
+            else:
+                text = normalize_question_text(question.get("question", ""))
+                signature = self.lsh.signature(text) if text else None
+            normalized.append(text)
+            signatures.append(signature)
+            if text:
+                entry_ids.append(self.lsh.add(question, signature=signature, text=text))
+
+        self._files[filename] = entry
+        self._normalized[filename] = normalized
+        self._signatures[filename] = signatures
+        self._entry_ids[filename] = entry_ids
+        self._question_ids.update(filter(None, map(identifying_id, questions)))
+
+    def _drop_entry(self, filename):
+        for entry_id in self._entry_ids.pop(filename, []):
+            self.lsh.remove(entry_id)
+        self._signatures.pop(filename, None)
+        self._normalized.pop(filename, None)
+        entry = self._files.pop(filename, None)
+        if entry:
+            self._question_ids.subtract(filter(None, map(identifying_id, entry.get("questions", []))))
+            self._question_ids += Counter()
+
+    @staticmethod
+    def _summarize(questions):
+        return [
+            {"id": question.get("id"), "question": question.get("question", "")}
+            for question in questions if isinstance(question, dict)
+        ]
+
+    def _read_file(self, path, stat):
+        checksum = _file_checksum(path)
+        with open(path, "r") as f:
+            data = json.load(f)
+        questions = data.get("questions") if isinstance(data, dict) else None
+        return {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": checksum,
+            "questions": self._summarize(questions if isinstance(questions, list) else [])
+        }
+
+    def refresh(self, force=False):
+        """
+        Bring the index up to date with data/generated
+
+        Args:
+            force (bool): Check files even if the refresh interval has not elapsed
+
+        Returns:
+            int: Number of files that were added, changed or removed
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+                return 0
+            self._last_refresh = now
+
+            try:
+                filenames = {name for name in os.listdir(self.generated_dir) if is_generated_questions_file(name)}
+            except FileNotFoundError:
+                filenames = set()
+
+            changed = 0
+            for filename in set(self._files) - filenames:
+                self._drop_entry(filename)
+                self._save_entry(filename)
+                changed += 1
+
+            for filename in filenames:
+                path = os.path.join(self.generated_dir, filename)
+                entry = self._files.get(filename)
+                try:
+                    stat = os.stat(path)
+                    if entry and entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+                        continue
+                    if entry and entry.get("sha256") == _file_checksum(path):
+                        entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+                        self._save_file_stat(filename)
+                        changed += 1
+                        continue
+                    self._set_entry(filename, self._read_file(path, stat))
+                except Exception as e:
+                    print(f"Error loading {filename}: {e}")
+                    continue
+                self._save_entry(filename)
+                changed += 1
+
+            return changed
+
+    def record_file(self, path, questions):
+        """
+        Update the index after a generated questions file has been written
+
+        Args:
+            path (str): Path of the file that was just written
+            questions (list): Questions written to it
+        """
+        filename = os.path.basename(path)
+        if not is_generated_questions_file(filename):
+            return
+
+        with self._lock:
+            try:
+                stat = os.stat(path)
+                entry = {
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "sha256": _file_checksum(path),
+                    "questions": self._summarize(questions)
+                }
+            except OSError as e:
+                print(f"Warning: could not index {path}: {e}")
+                return
+            self._set_entry(filename, entry)
+            self._save_entry(filename)
+
+    def questions(self):
+        """All indexed questions (id and question text only)"""
+        with self._lock:
+            self.refresh()
+            return [question for entry in self._files.values() for question in entry.get("questions", [])]
+
+    def has_id(self, question_id):
+        with self._lock:
+            return self._question_ids[question_id] > 0
+
+    def find_duplicate(self, question):
+        with self._lock:
+            self.refresh()
+            return self.lsh.find_duplicate(question)
+
+
+_dedup_index = None
+_dedup_index_lock = threading.Lock()
+
+
+def get_dedup_index():
+    """Process-wide PersistentDedupIndex, loaded on first use"""
+    global _dedup_index
+    with _dedup_index_lock:
+        if _dedup_index is None:
+            _dedup_index = PersistentDedupIndex()
+        return _dedup_index
+
+
+class DedupService:
+    """
+    Single entry point for duplicate checks in the app and the generation pipeline.
+
+    The corpus of previously generated questions is the process-wide
+    PersistentDedupIndex, so it is loaded once and shared by every caller.
+    All checks use normalize_question_text and the same threshold, and a
+    question whose (non-positional) ID is already known is a duplicate
+    regardless of its text. Counters of checks and duplicates found, by
+    reason, are kept for hit-rate reporting.
+    """
+
+    def __init__(self, threshold=DEDUP_SIMILARITY_THRESHOLD, index=None):
+        self.threshold = threshold
+        self._index = index
+        self._metrics = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = get_dedup_index()
+        return self._index
+
+    def _count(self, **counts):
+        with self._lock:
+            self._metrics.update(counts)
+
+    def corpus(self):
+        """Previously generated questions (id and question text)"""
+        return self.index.questions()
+
+    def record(self, path, questions):
+        """Update the corpus after saving questions to data/generated"""
+        self.index.record_file(path, questions)
+
+    def find_duplicate(self, question, existing_questions=None):
+        """
+        Find an existing question that the given one duplicates
+
+        Args:
+            question (dict): Question to check
+            existing_questions (list or index): Questions to check against (the shared corpus if None)
+
+        Returns:
+            tuple: (reason, matching question or ID, similarity) with reason "id" or "text", or None
+        """
+        existing = self.index if existing_questions is None else existing_questions
+        question_id = identifying_id(question)
+        match = None
+
+        if question_id:
+            if hasattr(existing, "has_id"):
+                if existing.has_id(question_id):
+                    match = ("id", question_id, 1.0)
+            elif not hasattr(existing, "find_duplicate"):
+                match = next(
+                    (("id", item, 1.0) for item in existing if identifying_id(item) == question_id), None
+                )
+
+        if match is None:
+            if hasattr(existing, "find_duplicate"):
+                found = existing.find_duplicate(question)
+            else:
+                found = self._pairwise_match(question, existing)
+            if found:
+                match = ("text",) + tuple(found)
+
+        self._count(checks=1, duplicates=int(match is not None), **({f"{match[0]}_matches": 1} if match else {}))
+        return match
+
+    def _pairwise_match(self, question, existing_questions):
+        text = normalize_question_text(question.get('question', ''))
+        if not text:
+            return None
+        for existing in existing_questions:
+            existing_text = normalize_question_text(existing.get('question', ''))
+            if not existing_text:
+                continue
+            similarity = SequenceMatcher(None, text, existing_text).ratio()
+            if similarity >= self.threshold:
+                return existing, similarity
+        return None
+
+    def is_duplicate(self, question, existing_questions=None):
+        match = self.find_duplicate(question, existing_questions)
+        if match:
+            print(f"Duplicate found ({match[0]}, {match[2]:.2f}): {question.get('question', '')[:50]}...")
+        return match is not None
+
+    def filter(self, new_questions, existing_questions=None, method="batch"):
+        """
+        Drop new questions that duplicate existing ones
+
+        Args:
+            new_questions (list): Candidate question dictionaries
+            existing_questions (list or index): Questions to check against (the shared corpus if None)
+            method (str): "batch" (default) scores the remaining questions at once with sparse n-gram
+                similarity matrices and also drops duplicates within the new batch; "index" looks each
+                question up in a MinHash/LSH index; "pairwise" compares every pair
+
+        Returns:
+            list: New questions that are not duplicates (with "batch", also not of earlier new ones)
+        """
+        existing = self.index if existing_questions is None else existing_questions
+        if method == "index" and not hasattr(existing, "find_duplicate"):
+            existing = MinHashLSHIndex(threshold=self.threshold).add_all(existing)
+
+        if method == "batch" and not hasattr(existing, "find_duplicate"):
+            self._count(checks=len(new_questions))
+            candidates = [question for question in new_questions if not self._id_duplicate(question, existing)]
+            existing_texts = [question.get('question', '') for question in existing]
+        else:
+            candidates = []
+            for question in new_questions:
+                if self.is_duplicate(question, existing):
+                    print(f"Filtered out duplicate: {question.get('question', '')[:50]}...")
+                else:
+                    candidates.append(question)
+            if method != "batch":
+                return candidates
+            existing_texts = []
+
+        matches = batch_duplicate_matches(
+            [question.get('question', '') for question in candidates], existing_texts, threshold=self.threshold
+        )
+
+        unique_questions = []
+        for question, match in zip(candidates, matches):
+            if match is None:
+                unique_questions.append(question)
+                continue
+            source, _, similarity = match
+            if source == "existing":
+                self._count(text_matches=1, duplicates=1)
+            else:
+                self._count(batch_matches=1)
+            label = "duplicate within batch" if source == "batch" else "duplicate"
+            print(f"Filtered out {label} ({similarity:.2f}): {question.get('question', '')[:50]}...")
+
+        return unique_questions
+
+    def _id_duplicate(self, question, existing_questions):
+        question_id = identifying_id(question)
+        is_duplicate = bool(question_id) and any(identifying_id(item) == question_id for item in existing_questions)
+        self._count(duplicates=int(is_duplicate), id_matches=int(is_duplicate))
+        if is_duplicate:
+            print(f"Filtered out duplicate (id {question_id}): {question.get('question', '')[:50]}...")
+        return is_duplicate
+
+    def stats(self):
+        """
+        Duplicate-check counters
+
+        Returns:
+            dict: checks, duplicates, id/text/batch match counts and hit_rate (duplicates per check)
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        for key in ("checks", "duplicates", "id_matches", "text_matches", "batch_matches"):
+            metrics.setdefault(key, 0)
+        metrics["hit_rate"] = metrics["duplicates"] / metrics["checks"] if metrics["checks"] else 0.0
+        return metrics
+
+
+# Process-wide service shared by the Streamlit app and the generation pipeline
+dedup_service = DedupService()
+
+
+def load_previous_questions():
+    """Previously generated questions from data/generated (id and question text, from the shared index)"""
+    return dedup_service.corpus()
+
+
+def is_duplicate_question(question, existing_questions=None, similarity_threshold=DEDUP_SIMILARITY_THRESHOLD):
+    """
+    Check if a question duplicates an existing one (the shared corpus if existing_questions is None)
+
+    Returns:
+        bool: True if the question is a duplicate, False otherwise
+    """
+    if similarity_threshold != dedup_service.threshold:
+        return DedupService(similarity_threshold, index=dedup_service.index).is_duplicate(question, existing_questions)
+    return dedup_service.is_duplicate(question, existing_questions)
+
+
+def record_generated_questions(path, questions):
+    """Update the duplicate-check corpus after saving questions to data/generated"""
+    dedup_service.record(path, questions)
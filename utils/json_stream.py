@@ -0,0 +1,98 @@
+import json
+import re
+
+
+class IncrementalArrayParser:
+    """
+    Incrementally parse objects out of a JSON array inside a streamed response.
+
+    Text is fed in arbitrary chunks as it arrives from the model. Once the
+    array under `key` (e.g. "questions": [ ... ]) has started, every object
+    element is returned by feed() as soon as its closing brace arrives, so
+    callers can work on the first element while later ones are still being
+    generated. Surrounding prose or code fences are ignored.
+    """
+
+    def __init__(self, key="questions"):
+        self._key_pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+        self.parsed_count = 0
+
+    @property
+    def finished(self):
+        """True once the closing bracket of the array has been seen"""
+        return self._finished
+
+    def feed(self, text):
+        """
+        Add a chunk of streamed text
+
+        Args:
+            text (str): Next chunk of model output
+
+        Returns:
+            list: Objects completed by this chunk
+        """
+        if self._finished or not text:
+            return []
+
+        self._buffer += text
+        completed = []
+
+        if not self._in_array:
+            match = self._key_pattern.search(self._buffer, max(0, self._pos - 64))
+            if not match:
+                self._pos = len(self._buffer)
+                return completed
+            self._in_array = True
+            self._pos = match.end()
+
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._object_start = i
+                self._depth += 1
+            elif char == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        completed.append(json.loads(buffer[self._object_start:i + 1]))
+                        self.parsed_count += 1
+                    except json.JSONDecodeError:
+                        print(f"Skipping malformed streamed object: {buffer[self._object_start:self._object_start + 80]}...")
+                    self._object_start = None
+            elif char == "]" and self._depth == 0:
+                self._finished = True
+                i += 1
+                break
+
+            i += 1
+
+        # Drop text that has already been consumed so the buffer stays small
+        keep_from = self._object_start if self._object_start is not None else i
+        self._buffer = buffer[keep_from:]
+        if self._object_start is not None:
+            self._object_start = 0
+        self._pos = i - keep_from
+
+        return completed
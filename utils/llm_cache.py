@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join("data", "llm_cache"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+
+class LLMResponseCache:
+    """
+    Content-addressed on-disk cache for LLM responses.
+
+    Entries are keyed by a hash of (model, generation params, prompt) and
+    stored as one JSON file each. Entries older than the TTL are ignored,
+    and once the cache grows past max_bytes the least recently used files
+    are evicted (a cache hit refreshes the file's mtime).
+    """
+
+    def __init__(self, cache_dir=LLM_CACHE_DIR, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES, enabled=not LLM_CACHE_DISABLED):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    @staticmethod
+    def make_key(model, params, prompt):
+        payload = json.dumps({"model": model, "params": params or {}, "prompt": prompt}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, model, params, prompt):
+        """
+        Look up a cached response
+
+        Returns:
+            str: Cached response text, or None on a miss or expired entry
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path(self.make_key(model, params, prompt))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        if self.ttl and time.time() - entry.get("created_at", 0) > self.ttl:
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry.get("response")
+
+    def set(self, model, params, prompt, response):
+        """Store a response text for (model, params, prompt)"""
+        if not self.enabled or response is None:
+            return
+
+        path = self._path(self.make_key(model, params, prompt))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created_at": time.time(), "model": model, "response": response})
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write LLM cache entry: {e}")
+            self._remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            self._remove(path)
+        with self._lock:
+            self._total_bytes = 0
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, _, size in self._entries())
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is back under 90% of max_bytes"""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for path, _, size in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._total_bytes = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cached_completion(model, params, prompt, generate, use_cache=True, validate=None):
+    """
+    Return a cached response or call generate() and cache its result
+
+    Args:
+        model (str): Model name used in the cache key
+        params (dict): Generation parameters used in the cache key
+        prompt (str): Prompt used in the cache key
+        generate (callable): Zero-argument function returning the response text
+        use_cache (bool): Set to False to bypass the cache for this call
+        validate (callable): Optional check on the text; only valid responses are cached
+
+    Returns:
+        str: Response text (may be None/empty if generation failed)
+    """
+    if use_cache:
+        cached = response_cache.get(model, params, prompt)
+        if cached is not None:
+            print(f"Using cached {model} response")
+            return cached
+
+    text = generate()
+
+    if use_cache and text and (validate is None or validate(text)):
+        response_cache.set(model, params, prompt, text)
+    return text
+
+
+# Module-level cache shared by every LLM call site
+response_cache = LLMResponseCache()
@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "180"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+
+
+class LLMClient:
+    """
+    Shared HTTP client for OpenAI chat completion calls.
+
+    Keeps a single requests.Session with a pooled, keep-alive connection
+    adapter so repeated calls reuse the same TCP/TLS connection instead of
+    paying a fresh handshake every time.
+    """
+
+    def __init__(self, api_key=None, pool_size=LLM_POOL_SIZE, default_timeout=LLM_DEFAULT_TIMEOUT):
+        """
+        Args:
+            api_key (str): OpenAI API key. Falls back to CHATGPT_API_KEY at call time.
+            pool_size (int): Maximum number of pooled connections per host
+            default_timeout (float): Timeout in seconds used when a call doesn't pass one
+        """
+        self.api_key = api_key
+        self.default_timeout = default_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive'
+        })
+
+    def get_api_key(self):
+        return self.api_key or os.getenv('CHATGPT_API_KEY')
+
+    def chat_completion(self, prompt, model="gpt-4.1", timeout=None, **params):
+        """
+        Send a single-message chat completion request through the pooled session
+
+        Args:
+            prompt (str): User message content
+            model (str): OpenAI model name
+            timeout (float): Per-call timeout in seconds (defaults to the client timeout)
+            **params: Extra request fields such as temperature
+
+        Returns:
+            requests.Response: Raw HTTP response
+        """
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            **params
+        }
+        return self.session.post(
+            OPENAI_CHAT_URL,
+            headers={'Authorization': f"Bearer {self.get_api_key()}"},
+            json=payload,
+            timeout=timeout or self.default_timeout
+        )
+
+    def close(self):
+        self.session.close()
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces out calls to at most a fixed number per minute.
+    A rate of 0 (or less) disables limiting.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute and requests_per_minute > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        """Block until the caller is allowed to issue its next request"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run_concurrently(func, items, max_workers=LLM_MAX_IN_FLIGHT, rate_limiter=None):
+    """
+    Apply func to every item using a bounded thread pool
+
+    Args:
+        func (callable): Function called with a single item
+        items (list): Items to process
+        max_workers (int): Maximum number of calls in flight at once
+        rate_limiter (RateLimiter): Optional limiter applied before each call
+
+    Returns:
+        list: Results in the same order as items
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item):
+        if rate_limiter:
+            rate_limiter.wait()
+        return func(item)
+
+    if max_workers is None or max_workers <= 1 or len(items) == 1:
+        return [call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
+
+# Module-level client shared by every LLM call site
+llm_client = LLMClient()
+
+# Process-wide LLM_REQUESTS_PER_MINUTE budget, shared by every caller (and every Streamlit session)
+llm_rate_limiter = RateLimiter()
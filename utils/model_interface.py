@@ -5,6 +5,11 @@ import os
 import re
 import traceback
 from utils.generate_diagram import extract_and_render_diagrams
+from utils.llm_client import llm_client, llm_rate_limiter, RateLimiter, run_concurrently, LLM_MAX_IN_FLIGHT
+from utils.llm_cache import response_cache, cached_completion
+from utils.json_stream import IncrementalArrayParser
+from utils.content_packer import pack_content, estimate_tokens, CONTENT_TOKEN_BUDGET
+from utils.dedup import MinHashLSHIndex, dedup_service, load_previous_questions, is_duplicate_question
 import google.generativeai as genai
 import uuid
 import subprocess
@@ -13,6 +18,8 @@ from collections import Counter
 import time
 import openai as OpenAI
 import random
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 
 load_dotenv()
 
@@ -23,6 +30,32 @@ genai.configure(api_key=gemma_api_key)
 DIAGRAM_FOLDER = os.path.join(os.getcwd(), "temp_diagrams")
 os.makedirs(DIAGRAM_FOLDER, exist_ok=True)
 
+GEMMA_MODEL = 'gemma-3-27b-it'
+QUESTION_GENERATION_CONFIG = {
+    'temperature': 0.2,
+    'top_p': 0.95,
+    'top_k': 40,
+    'max_output_tokens': 8192,
+}
+
+# Documents with more pages than this are generated in parallel page-range shards (0 disables)
+QUESTION_SHARD_PAGES = int(os.getenv("QUESTION_SHARD_PAGES", "0"))
+QUESTION_SHARD_WORKERS = int(os.getenv("QUESTION_SHARD_WORKERS", "4"))
+
+# Models queried in parallel by batch_solve_questions, and how many must agree before
+# the remaining ones stop being waited for
+SOLVE_MODELS = [model.strip() for model in os.getenv("SOLVE_MODELS", "gemma,gpt").split(",") if model.strip()]
+SOLVE_QUORUM = int(os.getenv("SOLVE_QUORUM", "0")) or None
+SOLVE_DEADLINE = float(os.getenv("SOLVE_DEADLINE", "200"))
+SOLVE_FALLBACK_DEADLINE = float(os.getenv("SOLVE_FALLBACK_DEADLINE", "120"))
+
+# Verification strategy: "concurrent" (one request per question) or "batch" (one request for all)
+VERIFY_MODE = os.getenv("VERIFY_MODE", "concurrent")
+
+# Flask backend holding the question-embedding collection used for semantic duplicate checks
+BACKEND_URL = os.getenv("BACKEND_FLASK_QBMS_APP")
+SEMANTIC_DEDUP_TIMEOUT = float(os.getenv("SEMANTIC_DEDUP_TIMEOUT", "30"))
+
 def load_prompt_template(template_file):
     """Load prompt template from file"""
     # template_path = os.path.join("prompts", template_file)
@@ -598,25 +631,60 @@ Format your response as a valid JSON object containing a list named "solutions".
     else:
         return ""
 
+def generate_gemma_text(prompt, generation_config=None, use_cache=True, validate=None):
+    """
+    Generate text with the Gemma model, going through the LLM response cache
+
+    Args:
+        prompt (str): Prompt text
+        generation_config (dict): Optional Gemini generation config
+        use_cache (bool): Set to False to bypass the cache
+        validate (callable): Optional check; only responses passing it are cached
+
+    Returns:
+        str: Generated text (empty if the model returned nothing)
+    """
+    def generate():
+        if generation_config:
+            model = genai.GenerativeModel(model_name=GEMMA_MODEL, generation_config=generation_config)
+        else:
+            model = genai.GenerativeModel(GEMMA_MODEL)
+        return model.generate_content(prompt).text
+
+    return cached_completion(GEMMA_MODEL, generation_config, prompt, generate, use_cache=use_cache, validate=validate)
+
+def generate_gpt_text(prompt, model="gpt-4.1", timeout=180, **params):
+    """Call an OpenAI chat model and return the message text, or None on an API error"""
+    response = llm_client.chat_completion(prompt, model=model, timeout=timeout, **params)
+
+    if response.status_code != 200:
+        print(f"Error calling {model} API: {response.status_code}")
+        print(response.text)
+        return None
+
+    return response.json()['choices'][0]['message']['content']
+
+def is_verifiable_question(q):
+    """Check that a question has the fields verification needs"""
+    required_fields = ['question', 'options', 'id']
+    
+    has_correct_answer = 'correct_answer' in q
+    has_answer = 'answer' in q
+    
+    if not all(field in q for field in required_fields) or not (has_correct_answer or has_answer):
+        print(f"Skipping question due to missing required fields: {q.get('id', 'Unknown')}")
+        return False
+        
+    if not isinstance(q.get('options'), (list, dict)):
+        print(f"Skipping question due to invalid options format: {q.get('id', 'Unknown')}")
+        return False
+
+    return True
+
 def verify_questions(questions, subject, content):
     print(f"Starting verification of {len(questions)} questions for subject: {subject}")
     
-    valid_questions = []
-    for q in questions:
-        required_fields = ['question', 'options', 'id']
-        
-        has_correct_answer = 'correct_answer' in q
-        has_answer = 'answer' in q
-        
-        if not all(field in q for field in required_fields) or not (has_correct_answer or has_answer):
-            print(f"Skipping question due to missing required fields: {q.get('id', 'Unknown')}")
-            continue
-            
-        if not isinstance(q.get('options'), (list, dict)):
-            print(f"Skipping question due to invalid options format: {q.get('id', 'Unknown')}")
-            continue
-            
-        valid_questions.append(q)
+    valid_questions = [q for q in questions if is_verifiable_question(q)]
     
     if not valid_questions:
         print("No valid questions to verify")
@@ -709,18 +777,11 @@ Now solve these questions:
     """
     
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f"Bearer {os.getenv('CHATGPT_API_KEY')}"
-            },
-            json={
-                "model": "gpt-4.1",
-                "messages": [{"role": "user", "content": solve_prompt}],
-                "temperature": 0.3,
-                "stream": False 
-            },
+        response = llm_client.chat_completion(
+            solve_prompt,
+            model="gpt-4.1",
+            temperature=0.3,
+            stream=False,
             timeout=180
         )
 
@@ -814,178 +875,409 @@ def clean_option_text(option_text):
     
     return option_text.strip()
 
-def verify_all_questions(questions, solved_answers, subject, content):
-    print(f"Verifying {len(questions)} questions...")
+def verify_all_questions(questions, solved_answers, subject, content, max_workers=LLM_MAX_IN_FLIGHT, requests_per_minute=None, mode=None):
+    """
+    Verify questions against their independently solved answers.
+
+    In "concurrent" mode one verification prompt per question is fanned out
+    over a bounded thread pool. In "batch" mode all questions are sent in a
+    single prompt and any question missing from the batch verdict table is
+    verified individually. Results keep the order of the input questions.
+
+    Args:
+        questions (list): Question dictionaries to verify
+        solved_answers (dict): Solutions keyed by question ID from solve_all_questions
+        subject (str): Subject area
+        content: Source content the questions were generated from
+        max_workers (int): Maximum verification requests in flight (1 runs sequentially)
+        requests_per_minute (float): Separate rate limit for this call (0 disables); by default the
+            process-wide llm_rate_limiter applies
+        mode (str): "concurrent" or "batch" (defaults to VERIFY_MODE)
+
+    Returns:
+        list: Verified question dictionaries
+    """
+    mode = mode or VERIFY_MODE
+    print(f"Verifying {len(questions)} questions (mode: {mode})...")
+
+    results = [None] * len(questions)
+    pending = list(range(len(questions)))
+
+    rate_limiter = llm_rate_limiter if requests_per_minute is None else RateLimiter(requests_per_minute)
+
+    if mode == "batch":
+        rate_limiter.wait()
+        batch_results = batch_verify_questions(questions, solved_answers, subject, content)
+        pending = []
+        for index, q in enumerate(questions):
+            question_id = q.get('id', '')
+            if question_id in batch_results:
+                results[index] = batch_results[question_id]
+            else:
+                pending.append(index)
+        if pending:
+            print(f"Batch verification did not cover {len(pending)} questions. Verifying them individually...")
+
+    individual_results = run_concurrently(
+        lambda index: verify_single_question(questions[index], solved_answers, subject, content),
+        pending,
+        max_workers=max_workers,
+        rate_limiter=rate_limiter
+    )
+    for index, result in zip(pending, individual_results):
+        results[index] = result
+
+    verified_questions = [q for q in results if q is not None]
+
+    print(f"Successfully verified {len(verified_questions)} questions")
+    return verified_questions
+
+def prepare_question_for_verification(q, solved_answers):
+    """Collect the cleaned question fields needed to build a verification prompt"""
+    question_id = q.get('id', '')
+    if question_id not in solved_answers:
+        print(f"Skipping question {question_id} - no solution provided")
+        return None
+
+    options = q.get('options', [])
+
+    # Clean option texts to remove explanations
+    if isinstance(options, list):
+        options = [clean_option_text(str(option)) for option in options]
+    elif isinstance(options, dict):
+        options = {k: clean_option_text(str(v)) for k, v in options.items()}
+
+    solution_info = solved_answers[question_id]
+    return {
+        "id": question_id,
+        "question": q['question'].strip(),
+        "options": options,
+        "current_answer": q.get('correct_answer', ''),
+        "solved_answer": solution_info.get('answer', ''),
+        "solved_confidence": solution_info.get('confidence_score', 0),
+        "question_confidence": q.get('confidence_score', 0)
+    }
+
+def apply_verification_verdict(q, prepared, valid_question, self_contained, answers_match):
+    """
+    Apply a yes/no verification verdict to a question
+
+    Returns:
+        dict: Verified copy of the question, or None if it failed validation
+    """
+    question_id = prepared['id']
+    options = prepared['options']
+    current_answer = prepared['current_answer']
+    solved_answer = prepared['solved_answer']
+    solved_confidence = prepared['solved_confidence']
+
+    if not valid_question or not self_contained:
+        print(f"Question {question_id} failed validation - skipping")
+        return None
+
+    if answers_match:
+        accepted_answer = current_answer
+    else:
+        if solved_confidence >= prepared['question_confidence']:
+            accepted_answer = solved_answer
+            q['correct_answer'] = solved_answer
+        else:
+            accepted_answer = current_answer
+
+    accepted_answer = clean_option_text(str(accepted_answer))
+
+    answer_in_options = any(
+        str(option).strip().lower() == str(accepted_answer).strip().lower() 
+        for option in options
+    )
+
+    if not answer_in_options and options:
+        replace_index = random.randint(0, len(options)-1)
+        options[replace_index] = accepted_answer
+        print(f"Updated options for question {question_id} - added correct answer")
+
+    verified_question = q.copy()
+    verified_question['options'] = options
+    verified_question['correct_answer'] = accepted_answer
+    verified_question['verification_status'] = "verified"
+    verified_question['solved_confidence'] = solved_confidence
+    return verified_question
+
+def verify_single_question(q, solved_answers, subject, content):
+    """Verify a single question, returning the verified copy or None if it is rejected"""
+    prepared = prepare_question_for_verification(q, solved_answers)
+    if prepared is None:
+        return None
+    question_id = prepared['id']
+
+    verification_prompt = f"""
+    Subject: {subject}
+    Content: {content}
     
-    verified_questions = []
+    Please verify this question:
     
-    for q in questions:
-        question_id = q.get('id', '')
-        if question_id not in solved_answers:
-            print(f"Skipping question {question_id} - no solution provided")
-            continue
-            
-        question_text = q['question'].strip()
-        options = q.get('options', [])
-        
-        # Clean option texts to remove explanations
-        if isinstance(options, list):
-            options = [clean_option_text(str(option)) for option in options]
-        elif isinstance(options, dict):
-            options = {k: clean_option_text(str(v)) for k, v in options.items()}
-        
-        current_answer = q.get('correct_answer', '')
-        solution_info = solved_answers[question_id]
-        solved_answer = solution_info.get('answer', '')
-        solved_confidence = solution_info.get('confidence_score', 0)
-        question_confidence = q.get('confidence_score', 0)
-        
-        verification_prompt = f"""
-        Subject: {subject}
-        Content: {content}
-        
-        Please verify this question:
-        
-        Question: {question_text}
-        Options: {options}
-        Current answer: {current_answer}
-        Solved answer: {solved_answer}
+    Question: {prepared['question']}
+    Options: {prepared['options']}
+    Current answer: {prepared['current_answer']}
+    Solved answer: {prepared['solved_answer']}
+    
+    IMPORTANT: Answer each question with ONLY a single word 'yes' or 'no' - no explanation, no additional text:
+    1. Is the question valid, well-formed, and directly related to the content?
+    2. Is the question self-contained without requiring external information?
+    3. Does the current answer match the solved answer?
+    
+    Format your response exactly like this:
+    1. yes/no
+    2. yes/no
+    3. yes/no
+    """
+    
+    try:
+        response = llm_client.chat_completion(
+            verification_prompt,
+            model="gpt-4",
+            temperature=0.3,
+            timeout=60
+        )
         
-        IMPORTANT: Answer each question with ONLY a single word 'yes' or 'no' - no explanation, no additional text:
-        1. Is the question valid, well-formed, and directly related to the content?
-        2. Is the question self-contained without requiring external information?
-        3. Does the current answer match the solved answer?
+        if response.status_code != 200:
+            print(f"Error verifying question {question_id}")
+            return None
+            
+        verification_response = response.json()['choices'][0]['message']['content']
+        lines = [line.strip().lower() for line in verification_response.split('\n') if line.strip()]
         
-        Format your response exactly like this:
-        1. yes/no
-        2. yes/no
-        3. yes/no
-        """
+        valid_question = "yes" in lines[0] if len(lines) > 0 else False
+        self_contained = "yes" in lines[1] if len(lines) > 1 else False
+        answers_match = "yes" in lines[2] if len(lines) > 2 else False
+
+        return apply_verification_verdict(q, prepared, valid_question, self_contained, answers_match)
         
-        try:
-            response = requests.post(
-                'https://api.openai.com/v1/chat/completions',
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f"Bearer {os.getenv('CHATGPT_API_KEY')}"
-                },
-                json={
-                    "model": "gpt-4",
-                    "messages": [{"role": "user", "content": verification_prompt}],
-                    "temperature": 0.3
-                },
-                timeout=60
-            )
-            
-            if response.status_code != 200:
-                print(f"Error verifying question {question_id}")
-                continue
-                
-            verification_response = response.json()['choices'][0]['message']['content']
-            lines = [line.strip().lower() for line in verification_response.split('\n') if line.strip()]
-            
-            valid_question = "yes" in lines[0] if len(lines) > 0 else False
-            self_contained = "yes" in lines[1] if len(lines) > 1 else False
-            answers_match = "yes" in lines[2] if len(lines) > 2 else False
-            
-            if not valid_question or not self_contained:
-                print(f"Question {question_id} failed validation - skipping")
-                continue
-                
-            if answers_match:
-                accepted_answer = current_answer
-            else:
-                if solved_confidence >= question_confidence:
-                    accepted_answer = solved_answer
-                    q['correct_answer'] = solved_answer
-                else:
-                    accepted_answer = current_answer
-            
-            accepted_answer = clean_option_text(str(accepted_answer))
-            
-            answer_in_options = any(
-                str(option).strip().lower() == str(accepted_answer).strip().lower() 
-                for option in options
-            )
-            
-            if not answer_in_options and options:
-                replace_index = random.randint(0, len(options)-1)
-                options[replace_index] = accepted_answer
-                print(f"Updated options for question {question_id} - added correct answer")
-            
-            verified_question = q.copy()
-            verified_question['options'] = options
-            verified_question['correct_answer'] = accepted_answer
-            verified_question['verification_status'] = "verified"
-            verified_question['solved_confidence'] = solved_confidence
-            verified_questions.append(verified_question)
-            
-        except Exception as e:
-            print(f"Error processing question {question_id}: {str(e)}")
-            continue
+    except Exception as e:
+        print(f"Error processing question {question_id}: {str(e)}")
+        return None
+
+def batch_verify_questions(questions, solved_answers, subject, content):
+    """
+    Verify all questions with a single prompt that returns a per-question verdict table
+
+    Returns:
+        dict: Verified question (or None if rejected) keyed by question ID,
+              only for questions covered by the batch response
+    """
+    prepared_questions = {}
+    for q in questions:
+        prepared = prepare_question_for_verification(q, solved_answers)
+        if prepared is not None:
+            prepared_questions[str(prepared['id'])] = (q, prepared)
+
+    if not prepared_questions:
+        return {}
+
+    verification_prompt = f"""
+    Subject: {subject}
+    Content: {content}
     
-    print(f"Successfully verified {len(verified_questions)} questions")
-    return verified_questions
+    Please verify each of the following questions.
+    
+    For EVERY question answer these with ONLY 'yes' or 'no':
+    1. Is the question valid, well-formed, and directly related to the content?
+    2. Is the question self-contained without requiring external information?
+    3. Does the current answer match the solved answer?
+    
+    """
+
+    for question_id, (_, prepared) in prepared_questions.items():
+        verification_prompt += f"""
+    QUESTION ID: {question_id}
+    Question: {prepared['question']}
+    Options: {prepared['options']}
+    Current answer: {prepared['current_answer']}
+    Solved answer: {prepared['solved_answer']}
+    """
+
+    verification_prompt += """
+    Respond with ONLY a verdict table, one line per question and no other text, exactly like this:
+    QUESTION ID | 1 | 2 | 3
+    q1 | yes | yes | no
+    q2 | no | yes | yes
+    """
 
-def generate_questions(content, subject, num_questions, difficulty_distribution, conversation_data=None):
     try:
-        # Format difficulty distribution for prompt - ensure we're using the correct counts
-        difficulty_format = ", ".join([f"{count} {level}" for level, count in difficulty_distribution.items() if count > 0])
+        response = llm_client.chat_completion(
+            verification_prompt,
+            model="gpt-4",
+            temperature=0.3,
+            timeout=180
+        )
 
-        # Validate that the sum of difficulties equals num_questions
-        total_difficulty_count = sum(difficulty_distribution.values())
-        if total_difficulty_count != num_questions:
-            # Adjust the hard difficulty to make the total match
-            difficulty_distribution["hard"] = max(0, num_questions - difficulty_distribution["easy"] - difficulty_distribution["medium"])
-            # Re-format with adjusted values
-            difficulty_format = ", ".join([f"{count} {level}" for level, count in difficulty_distribution.items() if count > 0])
+        if response.status_code != 200:
+            print(f"Error calling API for batch verification: {response.status_code}")
+            return {}
 
-        # Format content for prompt
-        content_formatted = "\n\n".join([f"--- {('Chapter' if len(content) > 1 else 'Page')} {num} ---\n{text}"
-                                      for num, text in content.items()])
-        
-        conversation_context = ""
-        if conversation_data:
-            topic = conversation_data.get('topic', 'the topic')
-            conversation_context = "\n\n### Conversation Context:\n"
-            conversation_context += f"These questions should be based on the learning session about: {topic}\n"
-            conversation_context += "Here's the conversation between the student and AI tutor:\n\n"
-            
-            for msg in conversation_data.get('messages', []):
-                role = "Student" if msg.get('sender') == 'user' else "Tutor"
-                conversation_context += f"{role}: {msg.get('message', '')}\n\n"
-            
-            conversation_context += "\nPay special attention to questions the student asked and concepts the tutor emphasized."
+        verification_response = response.json()['choices'][0]['message']['content']
+        verdicts = parse_verification_table(verification_response, prepared_questions.keys())
+    except Exception as e:
+        print(f"Error during batch verification: {str(e)}")
+        return {}
+
+    results = {}
+    for question_id, (valid_question, self_contained, answers_match) in verdicts.items():
+        q, prepared = prepared_questions[question_id]
+        results[prepared['id']] = apply_verification_verdict(q, prepared, valid_question, self_contained, answers_match)
+
+    print(f"Batch verification covered {len(results)} of {len(prepared_questions)} questions")
+    return results
+
+def parse_verification_table(verification_text, question_ids):
+    """
+    Parse "id | yes | no | yes" verdict lines into booleans
+
+    Args:
+        verification_text (str): Raw model response
+        question_ids (iterable): Question IDs expected in the table
+
+    Returns:
+        dict: (valid_question, self_contained, answers_match) keyed by question ID
+    """
+    expected_ids = {str(question_id).lower(): str(question_id) for question_id in question_ids}
+    verdicts = {}
+
+    for line in verification_text.split('\n'):
+        cells = [cell.strip().strip('*`').strip() for cell in line.strip().strip('|').split('|')]
+        if len(cells) < 4:
+            continue
 
-        # Load question generation prompt template
-        if subject.lower() in ["physics", "maths"]:
-            template = load_prompt_template("question_gen.txt")
+        question_id = expected_ids.get(cells[0].replace("QUESTION ID:", "").strip().lower())
+        answers = [cell.lower() for cell in cells[1:4]]
+        if question_id is None or not all(answer in ("yes", "no") for answer in answers):
+            continue
+
+        verdicts[question_id] = tuple(answer == "yes" for answer in answers)
+
+    return verdicts
+
+def parse_generated_questions(generated_text):
+    """
+    Extract the questions list from a complete question generation response
+
+    Raises:
+        json.JSONDecodeError: If no valid JSON could be found
+    """
+    json_match = re.search(r'```json\s*(.+?)\s*```', generated_text, re.DOTALL)
+    if json_match:
+        json_str = json_match.group(1)
+    else:
+        # Try to find JSON without code blocks
+        json_match = re.search(r'(\{.*"questions":\s*\[.+?\]\s*\})', generated_text, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(1)
         else:
-            template = load_prompt_template("question_gen_non_math.txt")
+            json_str = generated_text
 
+    result = json.loads(json_str)
+    return result.get('questions', [])
 
-        # Format prompt with stronger emphasis on question count and difficulty distribution
-        prompt = template.format(
-            num_questions=num_questions,
-            difficulty_distribution=difficulty_format, 
-            subject=subject,
-            content=content_formatted
-        )
+def is_complete_questions_response(generated_text):
+    """True if the response parses as a full questions payload, i.e. it is safe to cache and replay"""
+    try:
+        parse_generated_questions(generated_text)
+        return True
+    except (json.JSONDecodeError, AttributeError):
+        return False
 
-        # Add explicit instructions about question count and difficulty distribution
-        # prompt = prompt.replace("Generate {num_questions} questions",
-        #                        f"Generate EXACTLY {num_questions} questions. This is a requirement, not a suggestion.")
-        # prompt = prompt.replace("of varying difficulty: {difficulty_distribution}",
-        #                        f"with EXACTLY this difficulty distribution: {difficulty_format}. Do not deviate from this distribution.")
-        # Call Ollama API
-        # response = requests.post('http://192.168.31.137:11434/api/generate',
-        #                        json={
-        #                            "model": "gemma3:27b",
-        #                            "prompt": prompt,
-        #                            "stream": False
-        #                        })
+def prepare_generated_question(question, index, subject):
+    """Fill in default fields on a freshly generated question"""
+    if 'id' not in question:
+        question['id'] = f"q{index+1}"
+    if 'requires_diagram' not in question:
+        question['requires_diagram'] = True
+    if 'diagram_description' not in question:
+        question['diagram_description'] = f"Diagram for question: {question['question']}"
+    if 'confidence_score' not in question:
+        question['confidence_score'] = 0.8  # Default confidence score
+    # Add a new field to track if user has selected this question for diagram generation
+    question['user_selected_for_diagram'] = False
+    # Add subject field for later use
+    question['subject'] = subject
+    return question
+
+def build_question_prompt(content, subject, num_questions, difficulty_distribution, conversation_data=None, token_budget=CONTENT_TOKEN_BUDGET):
+    """
+    Build the full question generation prompt for the given content and settings.
+    Content larger than token_budget is packed down to the chunks most relevant
+    to the subject and conversation topic.
+    """
+    # Format difficulty distribution for prompt - ensure we're using the correct counts
+    difficulty_format = ", ".join([f"{count} {level}" for level, count in difficulty_distribution.items() if count > 0])
+
+    # Validate that the sum of difficulties equals num_questions
+    total_difficulty_count = sum(difficulty_distribution.values())
+    if total_difficulty_count != num_questions:
+        # Adjust the hard difficulty to make the total match
+        difficulty_distribution["hard"] = max(0, num_questions - difficulty_distribution["easy"] - difficulty_distribution["medium"])
+        # Re-format with adjusted values
+        difficulty_format = ", ".join([f"{count} {level}" for level, count in difficulty_distribution.items() if count > 0])
+
+    # Keep the prompt within the token budget
+    packing_query = subject
+    if conversation_data:
+        packing_query += " " + conversation_data.get('topic', '')
+        packing_query += " " + " ".join(
+            msg.get('message', '') for msg in conversation_data.get('messages', []) if msg.get('sender') == 'user'
+        )
+    content, packing_report = pack_content(content, packing_query, token_budget)
+    if packing_report["dropped_tokens"]:
+        print(f"Packed content to ~{packing_report['kept_tokens']} of ~{packing_report['total_tokens']} tokens "
+              f"(dropped {packing_report['dropped_chunks']} of {packing_report['total_chunks']} chunks, "
+              f"{packing_report['dropped_pages']} pages entirely)")
+
+    # Format content for prompt
+    content_formatted = "\n\n".join([f"--- {('Chapter' if len(content) > 1 else 'Page')} {num} ---\n{text}"
+                                  for num, text in content.items()])
+    
+    conversation_context = ""
+    if conversation_data:
+        topic = conversation_data.get('topic', 'the topic')
+        conversation_context = "\n\n### Conversation Context:\n"
+        conversation_context += f"These questions should be based on the learning session about: {topic}\n"
+        conversation_context += "Here's the conversation between the student and AI tutor:\n\n"
+        
+        for msg in conversation_data.get('messages', []):
+            role = "Student" if msg.get('sender') == 'user' else "Tutor"
+            conversation_context += f"{role}: {msg.get('message', '')}\n\n"
+        
+        conversation_context += "\nPay special attention to questions the student asked and concepts the tutor emphasized."
 
-        reasoning_prefix = """You are an expert mathematics and physics educator with deep subject knowledge. 
+    # Load question generation prompt template
+    if subject.lower() in ["physics", "maths"]:
+        template = load_prompt_template("question_gen.txt")
+    else:
+        template = load_prompt_template("question_gen_non_math.txt")
+
+
+    # Format prompt with stronger emphasis on question count and difficulty distribution
+    prompt = template.format(
+        num_questions=num_questions,
+        difficulty_distribution=difficulty_format, 
+        subject=subject,
+        content=content_formatted
+    )
+
+    # Add explicit instructions about question count and difficulty distribution
+    # prompt = prompt.replace("Generate {num_questions} questions",
+    #                        f"Generate EXACTLY {num_questions} questions. This is a requirement, not a suggestion.")
+    # prompt = prompt.replace("of varying difficulty: {difficulty_distribution}",
+    #                        f"with EXACTLY this difficulty distribution: {difficulty_format}. Do not deviate from this distribution.")
+    # Call Ollama API
+    # response = requests.post('http://192.168.31.137:11434/api/generate',
+    #                        json={
+    #                            "model": "gemma3:27b",
+    #                            "prompt": prompt,
+    #                            "stream": False
+    #                        })
+
+    reasoning_prefix = """You are an expert mathematics and physics educator with deep subject knowledge. 
     Your task is to generate accurate, self-contained multiple-choice questions that test understanding of mathematical and physical concepts.
 
     I want you to think carefully and follow these steps when creating the MCQs:
@@ -999,49 +1291,46 @@ def generate_questions(content, subject, num_questions, difficulty_distribution,
     
     Now, using the following instructions, generate high-quality MCQs:
     """
-        
-        if subject.lower() in ["physics", "maths"]:
-            enhanced_prompt = reasoning_prefix + prompt + conversation_context
-        else: 
-            enhanced_prompt = prompt + conversation_context
+    
+    if subject.lower() in ["physics", "maths"]:
+        enhanced_prompt = reasoning_prefix + prompt + conversation_context
+    else: 
+        enhanced_prompt = prompt + conversation_context
+
+    return enhanced_prompt
+
+def generate_questions(content, subject, num_questions, difficulty_distribution, conversation_data=None, use_cache=True, token_budget=CONTENT_TOKEN_BUDGET, shard_pages=QUESTION_SHARD_PAGES):
+    if shard_pages and len(content) > shard_pages:
+        return generate_questions_sharded(
+            content, subject, num_questions, difficulty_distribution,
+            conversation_data=conversation_data, shard_pages=shard_pages,
+            use_cache=use_cache, token_budget=token_budget
+        )
+
+    try:
+        enhanced_prompt = build_question_prompt(content, subject, num_questions, difficulty_distribution, conversation_data, token_budget)
 
         print("generating.........")
 
         # model = genai.GenerativeModel('gemma-3-27b-it')
-        model = genai.GenerativeModel(
-            model_name='gemma-3-27b-it',
-            generation_config={
-                'temperature': 0.2,
-                'top_p': 0.95, 
-                'top_k': 40,
-                'max_output_tokens': 8192,
-            }
+        generated_text = generate_gemma_text(
+            enhanced_prompt,
+            generation_config=QUESTION_GENERATION_CONFIG,
+            use_cache=use_cache,
+            validate=is_complete_questions_response
         )
-        response = model.generate_content(enhanced_prompt)
 
-        if not response.text:
+        if not generated_text:
             return {"error": "Generation failed: No response from model in Step 1."}
 
         # if response.status_code == 200:
             # response_data = response.json()
             # Extract JSON from response
             # generated_text = response_data.get('response', '')
-        generated_text = response.text
         print("==================================> generated text")
-        json_match = re.search(r'```json\s*(.+?)\s*```', generated_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # Try to find JSON without code blocks
-            json_match = re.search(r'(\{.*"questions":\s*\[.+?\]\s*\})', generated_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                json_str = generated_text
         try:
             # Parse JSON
-            result = json.loads(json_str)
-            questions = result.get('questions', [])
+            questions = parse_generated_questions(generated_text)
             print("<><><><><><><><><><><><>Question generated")
             # Ensure exactly num_questions are returned
             # if len(questions) < num_questions:
@@ -1068,18 +1357,7 @@ def generate_questions(content, subject, num_questions, difficulty_distribution,
 
             # Ensure each question has required fields
             for i, question in enumerate(questions):
-                if 'id' not in question:
-                    question['id'] = f"q{i+1}"
-                if 'requires_diagram' not in question:
-                    question['requires_diagram'] = True
-                if 'diagram_description' not in question:
-                    question['diagram_description'] = f"Diagram for question: {question['question']}"
-                if 'confidence_score' not in question:
-                    question['confidence_score'] = 0.8  # Default confidence score
-                # Add a new field to track if user has selected this question for diagram generation
-                question['user_selected_for_diagram'] = False
-                # Add subject field for later use
-                question['subject'] = subject
+                prepare_generated_question(question, i, subject)
 
             print("ques", questions)
             return questions
@@ -1098,7 +1376,231 @@ def generate_questions(content, subject, num_questions, difficulty_distribution,
         traceback.print_exc()
         return []
 
-def convert_question_difficulty(question, content, subject, new_difficulty):
+def split_content_into_shards(content, shard_pages):
+    """Split a content dict into consecutive page ranges of at most shard_pages pages"""
+    keys = list(content.keys())
+    return [
+        {key: content[key] for key in keys[start:start + shard_pages]}
+        for start in range(0, len(keys), shard_pages)
+    ]
+
+def allocate_proportionally(total, weights):
+    """Split an integer total across weights using the largest remainder method"""
+    weight_sum = sum(weights)
+    if total <= 0 or weight_sum <= 0:
+        return [0] * len(weights)
+
+    exact = [total * weight / weight_sum for weight in weights]
+    allocation = [int(share) for share in exact]
+    remainders = sorted(range(len(weights)), key=lambda i: exact[i] - allocation[i], reverse=True)
+    for i in remainders[:total - sum(allocation)]:
+        allocation[i] += 1
+    return allocation
+
+def generate_questions_sharded(content, subject, num_questions, difficulty_distribution, conversation_data=None,
+                               shard_pages=QUESTION_SHARD_PAGES, max_workers=QUESTION_SHARD_WORKERS,
+                               use_cache=True, token_budget=CONTENT_TOKEN_BUDGET):
+    """
+    Map-reduce question generation for large documents
+
+    The content is split into page ranges, each shard gets a share of
+    num_questions and of every difficulty level proportional to its size, and
+    shards are generated in parallel. The merged questions are de-duplicated
+    and re-numbered q1..qN.
+
+    Args:
+        content (dict): Content keyed by chapter/page number
+        subject (str): Subject area
+        num_questions (int): Total number of questions (0 lets the model decide per shard)
+        difficulty_distribution (dict): Total distribution of difficulty levels
+        conversation_data (dict): Optional conversation context
+        shard_pages (int): Pages per shard
+        max_workers (int): Maximum shards generated at once
+
+    Returns:
+        list: Merged questions
+    """
+    shard_jobs = plan_question_shards(content, num_questions, difficulty_distribution, shard_pages)
+    print(f"Generating questions over {len(shard_jobs)} shards of up to {shard_pages} pages...")
+
+    shard_results = run_concurrently(
+        lambda job: generate_questions(
+            job[0], subject, job[1], job[2],
+            conversation_data=conversation_data, use_cache=use_cache,
+            token_budget=token_budget, shard_pages=None
+        ),
+        shard_jobs,
+        max_workers=max_workers
+    )
+
+    merged_questions = []
+    merged_index = MinHashLSHIndex()
+    for questions in shard_results:
+        if not isinstance(questions, list):
+            print(f"Shard generation failed: {questions}")
+            continue
+        for question in questions:
+            if merged_index.find_duplicate(question):
+                print(f"Filtered out cross-shard duplicate: {question.get('question', '')[:50]}...")
+                continue
+            merged_questions.append(question)
+            merged_index.add(question)
+
+    for i, question in enumerate(merged_questions):
+        question['id'] = f"q{i+1}"
+
+    print(f"Merged {len(merged_questions)} questions from {len(shard_jobs)} shards")
+    return merged_questions
+
+def plan_question_shards(content, num_questions, difficulty_distribution, shard_pages):
+    """
+    Split content into shards and give each a share of num_questions and of every
+    difficulty level proportional to its size
+
+    Returns:
+        list: (shard content, number of questions, difficulty distribution) per shard that gets questions
+    """
+    shards = split_content_into_shards(content, shard_pages)
+    weights = [sum(estimate_tokens(str(text)) for text in shard.values()) for shard in shards]
+
+    level_allocations = {
+        level: allocate_proportionally(count, weights)
+        for level, count in difficulty_distribution.items()
+    }
+    question_allocation = allocate_proportionally(num_questions, weights)
+
+    shard_jobs = []
+    for i, shard in enumerate(shards):
+        shard_distribution = {level: allocation[i] for level, allocation in level_allocations.items()}
+        shard_questions = sum(shard_distribution.values()) or question_allocation[i]
+        if num_questions > 0 and shard_questions == 0:
+            continue
+        shard_jobs.append((shard, shard_questions, shard_distribution))
+
+    return shard_jobs
+
+def generate_questions_stream_sharded(content, subject, num_questions, difficulty_distribution, conversation_data=None,
+                                      shard_pages=QUESTION_SHARD_PAGES, max_workers=QUESTION_SHARD_WORKERS,
+                                      use_cache=True, token_budget=CONTENT_TOKEN_BUDGET):
+    """
+    Streaming version of generate_questions_sharded: shards are streamed in parallel and
+    each question is yielded as soon as any shard finishes writing it, skipping
+    cross-shard duplicates and re-numbering q1..qN in arrival order
+
+    Yields:
+        dict: Generated questions
+    """
+    shard_jobs = plan_question_shards(content, num_questions, difficulty_distribution, shard_pages)
+    print(f"Streaming questions over {len(shard_jobs)} shards of up to {shard_pages} pages...")
+    if not shard_jobs:
+        return
+
+    arrivals = queue.Queue()
+    shard_done = object()
+
+    def stream_shard(job):
+        try:
+            for question in generate_questions_stream(
+                job[0], subject, job[1], job[2], conversation_data=conversation_data,
+                use_cache=use_cache, token_budget=token_budget, shard_pages=None
+            ):
+                arrivals.put(question)
+        finally:
+            arrivals.put(shard_done)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shard_jobs))))
+    for job in shard_jobs:
+        executor.submit(stream_shard, job)
+    executor.shutdown(wait=False)
+
+    merged_index = MinHashLSHIndex()
+    remaining = len(shard_jobs)
+    count = 0
+    while remaining:
+        question = arrivals.get()
+        if question is shard_done:
+            remaining -= 1
+            continue
+        if merged_index.find_duplicate(question):
+            print(f"Filtered out cross-shard duplicate: {question.get('question', '')[:50]}...")
+            continue
+        merged_index.add(question)
+        count += 1
+        question['id'] = f"q{count}"
+        yield question
+
+    print(f"Merged {count} streamed questions from {len(shard_jobs)} shards")
+
+def generate_questions_stream(content, subject, num_questions, difficulty_distribution, conversation_data=None, use_cache=True, token_budget=CONTENT_TOKEN_BUDGET, shard_pages=QUESTION_SHARD_PAGES):
+    """
+    Streaming version of generate_questions that yields each question as soon as
+    the model has finished writing it
+
+    Args:
+        content (dict): Content keyed by chapter/page number
+        subject (str): Subject area
+        num_questions (int): Number of questions to generate
+        difficulty_distribution (dict): Distribution of difficulty levels
+        conversation_data (dict): Optional conversation context
+        use_cache (bool): Set to False to bypass the LLM response cache
+        token_budget (int): Maximum estimated content tokens in the prompt (0 disables packing)
+        shard_pages (int): Stream shards of this many pages in parallel when the content is longer (0/None disables)
+
+    Yields:
+        dict: Generated questions with default fields filled in
+    """
+    if shard_pages and len(content) > shard_pages:
+        yield from generate_questions_stream_sharded(
+            content, subject, num_questions, difficulty_distribution,
+            conversation_data=conversation_data, shard_pages=shard_pages,
+            use_cache=use_cache, token_budget=token_budget
+        )
+        return
+
+    try:
+        enhanced_prompt = build_question_prompt(content, subject, num_questions, difficulty_distribution, conversation_data, token_budget)
+
+        cached_text = response_cache.get(GEMMA_MODEL, QUESTION_GENERATION_CONFIG, enhanced_prompt) if use_cache else None
+        if cached_text is not None:
+            print("Using cached gemma-3-27b-it response")
+            chunks = [cached_text]
+        else:
+            print("generating (streaming).........")
+            model = genai.GenerativeModel(model_name=GEMMA_MODEL, generation_config=QUESTION_GENERATION_CONFIG)
+            chunks = (chunk.text for chunk in model.generate_content(enhanced_prompt, stream=True) if chunk.parts)
+
+        parser = IncrementalArrayParser("questions")
+        generated_parts = []
+        # A single chunk can complete several questions, so number them separately from parsed_count
+        index = 0
+        for text in chunks:
+            generated_parts.append(text)
+            for question in parser.feed(text):
+                yield prepare_generated_question(question, index, subject)
+                index += 1
+
+        generated_text = "".join(generated_parts)
+
+        if parser.parsed_count == 0:
+            # The stream never contained a parsable questions array; fall back to whole-response parsing
+            try:
+                for i, question in enumerate(parse_generated_questions(generated_text)):
+                    yield prepare_generated_question(question, i, subject)
+            except json.JSONDecodeError:
+                print("Failed to parse JSON from model response")
+                print("Response:", generated_text[:500])
+                return
+
+        # A stream cut short (e.g. at max_output_tokens) still yields its complete questions, but must not
+        # be cached: generate_questions reads the same entry and would fail to parse it until it expires
+        if use_cache and cached_text is None and is_complete_questions_response(generated_text):
+            response_cache.set(GEMMA_MODEL, QUESTION_GENERATION_CONFIG, enhanced_prompt, generated_text)
+
+    except Exception as e:
+        print(f"Error generating questions: {str(e)}")
+        traceback.print_exc()
+
+def convert_question_difficulty(question, content, subject, new_difficulty, use_cache=True):
     try:
         if question.get('difficulty', 'medium') == new_difficulty:
             return question
@@ -1142,13 +1644,14 @@ Return your response in this JSON format:
 """
         
 
-        model = genai.GenerativeModel('gemma-3-27b-it')
-        response = model.generate_content(prompt)
+        generated_text = generate_gemma_text(
+            prompt,
+            use_cache=use_cache,
+            validate=lambda text: extract_json_from_text(text) is not None
+        )
         
-        if not response.text:
+        if not generated_text:
             raise Exception("No response from model when converting question difficulty")
-            
-        generated_text = response.text
 
         json_match = re.search(r'```json\s*(.+?)\s*```', generated_text, re.DOTALL)
         if json_match:
@@ -1179,7 +1682,22 @@ Return your response in this JSON format:
         return question
 
 
-def batch_solve_questions(questions):
+def batch_solve_questions(questions, models=None, quorum=SOLVE_QUORUM, deadline=SOLVE_DEADLINE, use_cache=True):
+    """
+    Generate solutions for all questions with several models in parallel and
+    merge them into per-question consensus solutions
+
+    Args:
+        questions (list): Question dictionaries
+        models (list): Models to query (defaults to SOLVE_MODELS)
+        quorum (int): Number of agreeing models after which remaining models
+                      are not waited for (defaults to all models)
+        deadline (float): Seconds to wait for model results before merging what arrived
+        use_cache (bool): Set to False to bypass the LLM response cache
+
+    Returns:
+        dict: Consensus solutions keyed by question ID
+    """
     try:        
         formatted_questions = "\n\n".join([
             f"Question ID: {q['id']}\nQuestion: {q['question']}\nDifficulty: {q.get('difficulty', 'medium')}"
@@ -1202,55 +1720,27 @@ def batch_solve_questions(questions):
 
         print(f"Generating solutions for {len(questions)} questions...")
         
-        models = ["gemma", "gpt"] 
+        models = models or SOLVE_MODELS
+        quorum = min(quorum or len(models), len(models))
         
         model_solutions = []
-        
-        for model in models:
-            try:
-                print(f"Generating solutions using model: {model}")
-                
-                if model == "gemma":
-                    gemma_model = genai.GenerativeModel('gemma-3-27b-it')
-                    response = gemma_model.generate_content(prompt)
-                    
-                    if not response.text:
-                        print("Generation failed: No response from Gemma model")
-                        continue
-                    
-                    generated_text = response.text
-                    
-                elif model == "gpt":
-                    gpt_response = requests.post(
-                        'https://api.openai.com/v1/chat/completions',
-                        headers={
-                            'Content-Type': 'application/json',
-                            'Authorization': f"Bearer {os.getenv('CHATGPT_API_KEY')}"
-                        },
-                        json={
-                            "model": "gpt-4.1",
-                            "messages": [{"role": "user", "content": prompt}]
-                        },
-                        timeout=180
-                    )
 
-                    if gpt_response.status_code != 200:
-                        print(f"Error calling GPT-4.1 API: {gpt_response.status_code}")
-                        print(gpt_response.text)
-                        continue
-                
-                    generated_text = gpt_response.json()['choices'][0]['message']['content']
-                
-                result = extract_json_from_text(generated_text)
-                
-                if result and "solutions" in result and isinstance(result["solutions"], list):
-                    solutions_dict = {sol.get('id'): sol for sol in result["solutions"] if sol.get('id')}
+        # Dispatch every model at once; stop waiting when the deadline passes or
+        # enough models already agree on every question
+        executor = ThreadPoolExecutor(max_workers=len(models))
+        futures = [executor.submit(generate_model_solutions, model, prompt, use_cache) for model in models]
+        try:
+            for finished, future in enumerate(as_completed(futures, timeout=deadline), start=1):
+                solutions_dict = future.result()
+                if solutions_dict:
                     model_solutions.append(solutions_dict)
-                    print(f"Successfully extracted {len(solutions_dict)} solutions from {model}")
-                else:
-                    print(f"Failed to extract valid solutions from {model}")
-            except Exception as e:
-                print(f"Error with model {model}: {str(e)}")
+                if finished < len(futures) and has_quorum_agreement(questions, model_solutions, quorum):
+                    print(f"Quorum of {quorum} models reached - not waiting for remaining models")
+                    break
+        except FuturesTimeoutError:
+            print(f"Solution deadline of {deadline}s passed with {len(model_solutions)} of {len(models)} models finished")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
         
         consensus_solutions = {}
         
@@ -1300,6 +1790,71 @@ def batch_solve_questions(questions):
         traceback.print_exc()
         return {}
 
+def generate_model_solutions(model, prompt, use_cache=True):
+    """
+    Generate batch solutions with a single model
+
+    Returns:
+        dict: Solutions keyed by question ID, or None if the model failed
+    """
+    try:
+        print(f"Generating solutions using model: {model}")
+        
+        has_solutions = lambda text: "solutions" in (extract_json_from_text(text) or {})
+
+        if model == "gemma":
+            generated_text = generate_gemma_text(prompt, use_cache=use_cache, validate=has_solutions)
+            
+            if not generated_text:
+                print("Generation failed: No response from Gemma model")
+                return None
+            
+        elif model == "gpt":
+            generated_text = cached_completion(
+                "gpt-4.1",
+                {},
+                prompt,
+                lambda: generate_gpt_text(prompt, model="gpt-4.1", timeout=180),
+                use_cache=use_cache,
+                validate=has_solutions
+            )
+
+            if not generated_text:
+                return None
+
+        else:
+            print(f"Unknown solution model: {model}")
+            return None
+        
+        result = extract_json_from_text(generated_text)
+        
+        if result and "solutions" in result and isinstance(result["solutions"], list):
+            solutions_dict = {sol.get('id'): sol for sol in result["solutions"] if sol.get('id')}
+            print(f"Successfully extracted {len(solutions_dict)} solutions from {model}")
+            return solutions_dict
+
+        print(f"Failed to extract valid solutions from {model}")
+        return None
+    except Exception as e:
+        print(f"Error with model {model}: {str(e)}")
+        return None
+
+def has_quorum_agreement(questions, model_solutions, quorum):
+    """Check whether at least `quorum` models gave the same answer for every question"""
+    if len(model_solutions) < quorum:
+        return False
+
+    for q in questions:
+        answers = [
+            solution_dict[q['id']].get('correct_answer')
+            for solution_dict in model_solutions
+            if q['id'] in solution_dict and 'correct_answer' in solution_dict[q['id']]
+        ]
+        if not answers or Counter(answers).most_common(1)[0][1] < quorum:
+            return False
+
+    return True
+
 def ensure_valid_solution_simple(solution, question_id):
     """
     Ensure the solution has all required fields
@@ -1364,24 +1919,43 @@ def ensure_valid_solution(solution, question_id):
     if 'explanation' not in solution or not solution['explanation']:
         solution['explanation'] = f"Explanation for answer to question {question_id}"
 
-def solve_questions(questions):
+def solve_questions(questions, max_workers=LLM_MAX_IN_FLIGHT, fallback_deadline=SOLVE_FALLBACK_DEADLINE):
+    """
+    Generate solutions in batch, then fill in any missing ones individually
+
+    Args:
+        questions (list): Question dictionaries
+        max_workers (int): Maximum individual fallback requests in flight
+        fallback_deadline (float): Seconds to wait for the individual fallbacks;
+                                   solutions that arrive later are dropped
+
+    Returns:
+        dict: Solutions keyed by question ID (possibly partial)
+    """
     # Try batch solution generation first
     solutions_dict = batch_solve_questions(questions)
 
     # For any questions without solutions, try individual generation
-    missing_ids = [q['id'] for q in questions if q['id'] not in solutions_dict]
-    if missing_ids:
-        print(f"Missing solutions for {len(missing_ids)} questions. Trying to generate them individually...")
+    missing_questions = [q for q in questions if q['id'] not in solutions_dict]
+    if missing_questions:
+        print(f"Missing solutions for {len(missing_questions)} questions. Trying to generate them individually...")
 
-        for q in questions:
-            if q['id'] in missing_ids:
-                print(f"Generating individual solution for question {q['id']}...")
-                individual_solution = generate_individual_solution(q)
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing_questions))))
+        futures = {executor.submit(generate_individual_solution, q): q['id'] for q in missing_questions}
+        try:
+            for future in as_completed(futures, timeout=fallback_deadline):
+                question_id = futures[future]
+                individual_solution = future.result()
                 if individual_solution:
-                    solutions_dict[q['id']] = individual_solution
-                    print(f"Successfully generated solution for {q['id']}")
+                    solutions_dict[question_id] = individual_solution
+                    print(f"Successfully generated solution for {question_id}")
                 else:
-                    print(f"Failed to generate solution for {q['id']}, creating fallback solution")
+                    print(f"Failed to generate solution for {question_id}, creating fallback solution")
+        except FuturesTimeoutError:
+            timed_out = [question_id for future, question_id in futures.items() if not future.done()]
+            print(f"Individual solution deadline passed - returning partial results without {', '.join(timed_out)}")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     return solutions_dict
 
@@ -1455,83 +2029,85 @@ def request_additional_questions(prompt, num_needed):
         print(f"Error getting additional questions: {str(e)}")
         return []
 
-def load_previous_questions():
-    """Load all previously generated questions from the data/generated folder"""
-    previous_questions = []
-    generated_dir = "data/generated"
-
-    if not os.path.exists(generated_dir):
-        return previous_questions
-
-    for filename in os.listdir(generated_dir):
-        if filename.endswith("_questions.json") or filename.endswith("_questions_with_diagrams.json"):
-            try:
-                with open(os.path.join(generated_dir, filename), 'r') as f:
-                    data = json.load(f)
-                    if "questions" in data and isinstance(data["questions"], list):
-                        previous_questions.extend(data["questions"])
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
-
-    return previous_questions
-
-def is_duplicate_question(question, existing_questions, similarity_threshold=0.8):
+def filter_out_duplicates(new_questions, existing_questions=None, method="batch"):
     """
-    Check if a question is too similar to any existing questions
+    Filter out duplicate questions from a list of new questions (see DedupService.filter)
 
     Args:
-        question (dict): The new question to check
-        existing_questions (list): List of existing question dictionaries
-        similarity_threshold (float): Threshold for considering questions similar (0-1)
+        new_questions (list): Candidate question dictionaries
+        existing_questions (list or index): Questions to check against (the shared corpus if None)
+        method (str): "batch", "index" or "pairwise"
 
     Returns:
-        bool: True if the question is a duplicate, False otherwise
+        list: New questions that are not duplicates
     """
-    from difflib import SequenceMatcher
+    return dedup_service.filter(new_questions, existing_questions, method=method)
 
-    question_text = question.get('question', '').lower()
-    if not question_text:
-        return False
-
-    for existing in existing_questions:
-        existing_text = existing.get('question', '').lower()
-        if not existing_text:
-            continue
+def find_semantic_duplicates(questions, threshold=None, timeout=SEMANTIC_DEDUP_TIMEOUT):
+    """
+    Check a batch of questions against the backend's question-embedding collection in one request
 
-        # Calculate similarity ratio
-        similarity = SequenceMatcher(None, question_text, existing_text).ratio()
-        if similarity >= similarity_threshold:
-            print(f"Duplicate found ({similarity:.2f}): {question_text[:50]}... vs {existing_text[:50]}...")
-            return True
+    Args:
+        questions (list): Candidate question dictionaries
+        threshold (float): Cosine similarity threshold (backend default if None)
+        timeout (float): Request timeout in seconds
 
-    return False
+    Returns:
+        list: One bool per question (True if it is a semantic duplicate), or None if the backend is unavailable
+    """
+    if not BACKEND_URL:
+        return None
+    if not questions:
+        return []
 
-def filter_out_duplicates(new_questions, existing_questions):
-    """Filter out duplicate questions from a list of new questions"""
-    unique_questions = []
+    payload = {"questions": [question.get('question', '') for question in questions]}
+    if threshold is not None:
+        payload["threshold"] = threshold
 
-    for question in new_questions:
-        if not is_duplicate_question(question, existing_questions):
-            unique_questions.append(question)
-        else:
-            print(f"Filtered out duplicate: {question.get('question', '')[:50]}...")
+    try:
+        response = requests.post(f"{BACKEND_URL}/api/questions/similar", json=payload, timeout=timeout)
+        response.raise_for_status()
+        results = response.json().get("results", [])
+    except Exception as e:
+        print(f"Semantic duplicate check unavailable, using local check only: {e}")
+        return None
 
-    return unique_questions
+    flags = [False] * len(questions)
+    for result in results:
+        index = result.get('index')
+        if isinstance(index, int) and 0 <= index < len(flags):
+            flags[index] = bool(result.get('is_duplicate'))
+            if flags[index] and result.get('neighbours'):
+                print(f"Semantic duplicate ({result['neighbours'][0].get('similarity', 0):.2f}): "
+                      f"{questions[index].get('question', '')[:50]}...")
+    return flags
+
+def generate_questions_with_duplicate_check(content, subject, num_questions, difficulty_distribution, conversation_data=None, use_cache=True):
+    """
+    Generate questions while checking for duplicates against previously generated questions
 
-def generate_questions_with_duplicate_check(content, subject, num_questions, difficulty_distribution, conversation_data=None):
-    """Generate questions while checking for duplicates against previously generated questions"""
+    Args:
+        use_cache (bool): Set to False for an explicit (re)generate request; a cached response would
+            replay questions that were already saved and are now all filtered out as duplicates
+    """
     # Load existing questions
-    existing_questions = load_previous_questions()
-    print(f"Loaded {len(existing_questions)} previously generated questions for duplicate checking.")
+    existing_questions = dedup_service.index
+    print(f"Loaded {len(existing_questions.lsh)} previously generated questions for duplicate checking.")
 
     # First attempt to generate the requested number of questions
-    questions = generate_questions(content, subject, num_questions, difficulty_distribution, conversation_data=conversation_data)
+    questions = generate_questions(content, subject, num_questions, difficulty_distribution, conversation_data=conversation_data, use_cache=use_cache)
 
-    # Filter out any duplicates
+    # Filter out near-identical duplicates locally, then paraphrases with one vector query for the whole batch
     unique_questions = filter_out_duplicates(questions, existing_questions)
-    print("que", questions)
+    semantic_duplicates = find_semantic_duplicates(unique_questions)
+    if semantic_duplicates is not None:
+        unique_questions = [
+            question for question, is_duplicate in zip(unique_questions, semantic_duplicates) if not is_duplicate
+        ]
+    print("que", unique_questions)
+    print(f"Duplicate check stats: {dedup_service.stats()}")
 
-    verified_questions = verify_questions(questions, subject, content)
+    verified_questions = verify_questions(unique_questions, subject, content)
     
     # Continue with the verified questions
     unique_questions = verified_questions
@@ -1563,12 +2139,13 @@ def update_questions_with_user_selections(questions, selected_question_ids):
 
     return questions
 
-def generate_diagrams_for_selected_questions(questions):
+def generate_diagrams_for_selected_questions(questions, use_cache=True):
     """
     Generate diagrams only for questions that have been selected by the user
 
     Args:
         questions (list): List of question dictionaries
+        use_cache (bool): Set to False to draw new diagrams instead of replaying cached ones
 
     Returns:
     """
@@ -1577,7 +2154,7 @@ def generate_diagrams_for_selected_questions(questions):
     for question in questions:
         if question.get('user_selected_for_diagram', False):
             question_id = question.get('id')
-            latex_code = generate_diagram_for_question(question)
+            latex_code = generate_diagram_for_question(question, use_cache=use_cache)
             if latex_code:
                 diagrams[question_id] = latex_code
 
@@ -1613,11 +2190,20 @@ def extract_json_from_text(text):
     except:
         return None
 
-def generate_diagram_for_question(question, max_retries=2):
+def generate_diagram_for_question(question, max_retries=2, use_cache=True):
     try:
         description = question.get('diagram_description', '')
         q_text = question.get('question', '')
         subject = question.get('subject', 'Physics')
+
+        # Only successfully compiled diagrams are cached, keyed by the diagram inputs
+        cache_params = {"task": "tikz_diagram", "subject": subject}
+        cache_prompt = f"{q_text}\n\n{description}"
+        if use_cache:
+            cached_latex = response_cache.get("gpt-4.1", cache_params, cache_prompt)
+            if cached_latex:
+                print("Using cached LaTeX diagram")
+                return cached_latex
         
         retry_count = 0
         previous_error_info = ""
@@ -1703,17 +2289,10 @@ DO NOT output any explanations, analysis, or comments - PROVIDE ONLY THE COMPILA
                 if not api_key:
                     raise ValueError("API key not found. Set CHATGPT_API_KEY environment variable.")
                 
-                gpt_response = requests.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    headers={
-                        'Content-Type': 'application/json',
-                        'Authorization': f"Bearer {api_key}"
-                    },
-                    json={
-                        "model": "gpt-4.1",
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.2 
-                    }
+                gpt_response = llm_client.chat_completion(
+                    prompt,
+                    model="gpt-4.1",
+                    temperature=0.2
                 )
                 
                 if gpt_response.status_code != 200:
@@ -1821,6 +2400,8 @@ DO NOT output any explanations, analysis, or comments - PROVIDE ONLY THE COMPILA
                         continue
                     
                     print("Successfully compiled LaTeX code")
+                    if use_cache:
+                        response_cache.set("gpt-4.1", cache_params, cache_prompt, latex_content)
                     return latex_content
                     
                 finally:
@@ -1844,12 +2425,21 @@ DO NOT output any explanations, analysis, or comments - PROVIDE ONLY THE COMPILA
         traceback.print_exc()
         return None
 
-def generate_diagram_with_instructions(question, instructions, max_retries=2):
+def generate_diagram_with_instructions(question, instructions, max_retries=2, use_cache=True):
     try:
         description = question.get('diagram_description', '')
         q_text = question.get('question', '')
         subject = question.get('subject', 'Physics')
         original_code = question.get('diagram_matplotlib', '')
+
+        # Only successfully compiled diagrams are cached, keyed by the diagram inputs
+        cache_params = {"task": "tikz_diagram_modification", "subject": subject}
+        cache_prompt = f"{q_text}\n\n{description}\n\n{original_code}\n\n{instructions}"
+        if use_cache:
+            cached_latex = response_cache.get("gpt-4.1", cache_params, cache_prompt)
+            if cached_latex:
+                print("Using cached modified LaTeX diagram")
+                return cached_latex
         
         retry_count = 0
         previous_error_info = ""
@@ -1980,17 +2570,10 @@ DO NOT output any explanations, analysis, or comments - PROVIDE ONLY THE COMPILA
                 if not api_key:
                     raise ValueError("API key not found. Set CHATGPT_API_KEY environment variable.")
                 
-                gpt_response = requests.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    headers={
-                        'Content-Type': 'application/json',
-                        'Authorization': f"Bearer {api_key}"
-                    },
-                    json={
-                        "model": "gpt-4.1",
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.2
-                    }
+                gpt_response = llm_client.chat_completion(
+                    prompt,
+                    model="gpt-4.1",
+                    temperature=0.2
                 )
                 
                 if gpt_response.status_code != 200:
@@ -2101,6 +2684,8 @@ DO NOT output any explanations, analysis, or comments - PROVIDE ONLY THE COMPILA
                         continue
                     
                     print("Successfully compiled modified LaTeX code")
+                    if use_cache:
+                        response_cache.set("gpt-4.1", cache_params, cache_prompt, latex_content)
                     return latex_content
                     
                 finally:
@@ -2125,7 +2710,7 @@ DO NOT output any explanations, analysis, or comments - PROVIDE ONLY THE COMPILA
         return None
 
 # New two-step process to generate questions and then MCQ answers
-def generate_questions_with_solutions(content, subject, num_questions, difficulty_distribution):
+def generate_questions_with_solutions(content, subject, num_questions, difficulty_distribution, use_cache=True):
     """
     Two-step process:
     1. Generate questions
@@ -2136,12 +2721,13 @@ def generate_questions_with_solutions(content, subject, num_questions, difficult
         subject (str): Subject area
         num_questions (int): Number of questions to generate
         difficulty_distribution (dict): Distribution of difficulty levels
+        use_cache (bool): Set to False to sample new questions instead of replaying a cached response
 
     Returns:
         list: Questions with solutions and MCQ options
     """
     # Step 1: Generate questions with duplicate checking
-    questions = generate_questions_with_duplicate_check(content, subject, num_questions, difficulty_distribution)
+    questions = generate_questions_with_duplicate_check(content, subject, num_questions, difficulty_distribution, use_cache=use_cache)
     print(f"Generated {len(questions)} unique questions.")
 
     # Step 2: Generate solutions with MCQ options for the questions
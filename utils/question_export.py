@@ -0,0 +1,153 @@
+import io
+import os
+import importlib.util
+import csv
+import gzip
+import json
+from itertools import islice
+
+# Served by Streamlit's static file serving (enableStaticServing in .streamlit/config.toml) at app/static/exports/
+EXPORT_DIR = os.path.join("static", "exports")
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+EXPORT_COMPRESSIONS = (None, "gzip", "zstd")
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+# Flat columns written to CSV and Parquet; list/dict values are stored as JSON text
+EXPORT_FIELDS = [
+    "id", "title", "question", "options", "correct_answer", "explanation", "subject",
+    "difficulty", "source", "generated_on", "requires_diagram", "diagram_description"
+]
+
+_EXTENSIONS = {"jsonl": ".jsonl", "csv": ".csv", "parquet": ".parquet"}
+_COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+_MIME_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+def export_filename(base_name, fmt, compression=None):
+    """File name for an export, e.g. questions.jsonl.gz (Parquet compresses internally, so no suffix)"""
+    suffix = _EXTENSIONS[fmt]
+    if compression and fmt != "parquet":
+        suffix += _COMPRESSION_EXTENSIONS[compression]
+    return base_name + suffix
+
+
+def _importable(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def available_export_formats():
+    """Export formats whose dependencies are installed (pyarrow is in requirements.txt; this covers partial installs)"""
+    return tuple(fmt for fmt in EXPORT_FORMATS if fmt != "parquet" or _importable("pyarrow"))
+
+
+def available_export_compressions(fmt):
+    """Compressions usable for fmt (Parquet has its own zstd codec; text formats need 'zstandard')"""
+    return tuple(
+        compression for compression in EXPORT_COMPRESSIONS
+        if compression != "zstd" or fmt == "parquet" or _importable("zstandard")
+    )
+
+
+def export_mime_type(fmt, compression=None):
+    if compression and fmt != "parquet":
+        return "application/gzip" if compression == "gzip" else "application/zstd"
+    return _MIME_TYPES[fmt]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _flat_row(question):
+    row = {}
+    for field in EXPORT_FIELDS:
+        value = question.get(field)
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value, ensure_ascii=False)
+        row[field] = None if value is None else str(value)
+    return row
+
+
+def _open_text(path, compression):
+    """Text stream writing to path with optional gzip/zstd compression"""
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        raw = open(path, "wb")
+        writer = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(writer, encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def _write_parquet(questions, path, compression, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export requires the 'pyarrow' package")
+
+    schema = pa.schema([(field, pa.string()) for field in EXPORT_FIELDS])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression=compression or "snappy") as writer:
+        for chunk in _chunks(questions, chunk_size):
+            writer.write_table(pa.Table.from_pylist([_flat_row(question) for question in chunk], schema=schema))
+            count += len(chunk)
+    return count
+
+
+def export_questions(questions, path, fmt="jsonl", compression=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Write questions to a file chunk by chunk
+
+    `questions` can be any iterable, e.g. QuestionStore.iter_questions(), so
+    memory use stays bounded by chunk_size regardless of the export size.
+
+    Args:
+        questions (iterable): Question dictionaries
+        path (str): Output file path
+        fmt (str): "jsonl", "csv" or "parquet"
+        compression (str): None, "gzip" or "zstd" (for Parquet, the column codec)
+        chunk_size (int): Questions written per chunk
+
+    Returns:
+        int: Number of questions written
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if compression not in EXPORT_COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        if fmt == "parquet":
+            count = _write_parquet(questions, tmp_path, compression, chunk_size)
+        else:
+            count = 0
+            with _open_text(tmp_path, compression) as f:
+                writer = None
+                if fmt == "csv":
+                    writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+                    writer.writeheader()
+                for chunk in _chunks(questions, chunk_size):
+                    if writer:
+                        writer.writerows(_flat_row(question) for question in chunk)
+                    else:
+                        f.write("".join(json.dumps(question, ensure_ascii=False) + "\n" for question in chunk))
+                    count += len(chunk)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return count
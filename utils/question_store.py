@@ -0,0 +1,466 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+QUESTION_STORE_PATH = os.getenv("QUESTION_STORE_PATH", os.path.join("data", "question_database", "questions.db"))
+LEGACY_QUESTION_DB_PATH = os.path.join("data", "question_database", "all_questions.json")
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+_MIGRATIONS = [
+    """
+    CREATE TABLE questions (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX idx_questions_title ON questions(title);
+    CREATE TABLE store_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    """
+    ALTER TABLE questions ADD COLUMN subject TEXT NOT NULL DEFAULT 'Unknown';
+    ALTER TABLE questions ADD COLUMN difficulty TEXT NOT NULL DEFAULT 'medium';
+    ALTER TABLE questions ADD COLUMN source TEXT NOT NULL DEFAULT 'Unknown';
+    ALTER TABLE questions ADD COLUMN generated_on TEXT NOT NULL DEFAULT '';
+    UPDATE questions SET
+        subject = COALESCE(json_extract(data, '$.subject'), 'Unknown'),
+        difficulty = COALESCE(json_extract(data, '$.difficulty'), 'medium'),
+        source = COALESCE(json_extract(data, '$.source'), 'Unknown'),
+        generated_on = COALESCE(json_extract(data, '$.generated_on'), '');
+    CREATE INDEX idx_questions_generated_on ON questions(generated_on DESC, id DESC);
+    CREATE INDEX idx_questions_filters ON questions(subject, difficulty, generated_on DESC, id DESC);
+    """,
+    """
+    ALTER TABLE questions ADD COLUMN generated_day TEXT
+        GENERATED ALWAYS AS (substr(generated_on, 1, 8)) VIRTUAL;
+    ALTER TABLE questions ADD COLUMN has_diagram INTEGER
+        GENERATED ALWAYS AS (COALESCE(json_extract(data, '$.requires_diagram'), 0) NOT IN (0, '')) VIRTUAL;
+    CREATE TABLE question_stats (
+        subject TEXT NOT NULL,
+        difficulty TEXT NOT NULL,
+        source TEXT NOT NULL,
+        generated_day TEXT NOT NULL,
+        has_diagram INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (subject, difficulty, source, generated_day, has_diagram)
+    ) WITHOUT ROWID;
+    CREATE TRIGGER question_stats_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO question_stats VALUES (new.subject, new.difficulty, new.source, new.generated_day, new.has_diagram, 1)
+        ON CONFLICT (subject, difficulty, source, generated_day, has_diagram) DO UPDATE SET count = count + 1;
+    END;
+    CREATE TRIGGER question_stats_update AFTER UPDATE ON questions
+    WHEN old.subject IS NOT new.subject OR old.difficulty IS NOT new.difficulty OR old.source IS NOT new.source
+        OR old.generated_day IS NOT new.generated_day OR old.has_diagram IS NOT new.has_diagram
+    BEGIN
+        UPDATE question_stats SET count = count - 1
+        WHERE subject = old.subject AND difficulty = old.difficulty AND source = old.source
+            AND generated_day = old.generated_day AND has_diagram = old.has_diagram;
+        DELETE FROM question_stats
+        WHERE subject = old.subject AND difficulty = old.difficulty AND source = old.source
+            AND generated_day = old.generated_day AND has_diagram = old.has_diagram AND count <= 0;
+        INSERT INTO question_stats VALUES (new.subject, new.difficulty, new.source, new.generated_day, new.has_diagram, 1)
+        ON CONFLICT (subject, difficulty, source, generated_day, has_diagram) DO UPDATE SET count = count + 1;
+    END;
+    CREATE TRIGGER question_stats_delete AFTER DELETE ON questions BEGIN
+        UPDATE question_stats SET count = count - 1
+        WHERE subject = old.subject AND difficulty = old.difficulty AND source = old.source
+            AND generated_day = old.generated_day AND has_diagram = old.has_diagram;
+        DELETE FROM question_stats
+        WHERE subject = old.subject AND difficulty = old.difficulty AND source = old.source
+            AND generated_day = old.generated_day AND has_diagram = old.has_diagram AND count <= 0;
+    END;
+    INSERT INTO question_stats
+        SELECT subject, difficulty, source, generated_day, has_diagram, COUNT(*)
+        FROM questions GROUP BY subject, difficulty, source, generated_day, has_diagram;
+    """,
+]
+
+# Full-text index over question text, options, explanation and source. It is created outside
+# the numbered migrations because SQLite builds without FTS5 fall back to LIKE search.
+_FTS_COLUMNS_SQL = """
+    json_extract({row}.data, '$.question'),
+    (SELECT group_concat(value, ' ') FROM json_each({row}.data, '$.options')),
+    json_extract({row}.data, '$.explanation'),
+    {row}.source
+"""
+_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+        question, options, explanation, source,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts (rowid, question, options, explanation, source)
+        VALUES (new.id, {_FTS_COLUMNS_SQL.format(row="new")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF data, source ON questions BEGIN
+        DELETE FROM questions_fts WHERE rowid = old.id;
+        INSERT INTO questions_fts (rowid, question, options, explanation, source)
+        VALUES (new.id, {_FTS_COLUMNS_SQL.format(row="new")});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+        DELETE FROM questions_fts WHERE rowid = old.id;
+    END""",
+    f"""INSERT INTO questions_fts (rowid, question, options, explanation, source)
+        SELECT q.id, {_FTS_COLUMNS_SQL.format(row="q")} FROM questions q""",
+]
+
+# bm25 column weights (question, options, explanation, source) and snippet length in tokens
+FTS_WEIGHTS = (10.0, 3.0, 2.0, 1.0)
+FTS_SNIPPET_TOKENS = 12
+
+# Columns that can be filtered and grouped on, and the default used when a question lacks the field
+FILTER_COLUMNS = {"subject": "Unknown", "difficulty": "medium", "source": "Unknown"}
+# Dimensions of the trigger-maintained question_stats counters
+STATS_COLUMNS = ("subject", "difficulty", "source", "generated_day", "has_diagram")
+
+
+def _split_statements(script):
+    """Split an SQL script into complete statements (trigger bodies contain semicolons)"""
+    statements, buffer = [], ""
+    for part in script.split(";"):
+        buffer += part + ";"
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(" \n;"):
+                statements.append(buffer.strip())
+            buffer = ""
+    return statements
+
+
+class QuestionStore:
+    """
+    SQLite question bank (WAL mode) keyed by unique question title.
+
+    Each question is stored as its JSON document in one row per title,
+    with subject, difficulty, source and generated_on copied into indexed
+    columns for filtering, paging and counts.
+    upsert_questions() has the same semantics as the old all_questions.json
+    merge: a question whose title already exists is merged into it
+    ({**existing, **new}), otherwise it is inserted. Only the rows in the
+    batch are touched, inside a single write transaction, so concurrent
+    sessions cannot overwrite each other's saves.
+    """
+
+    def __init__(self, path=QUESTION_STORE_PATH, legacy_json_path=LEGACY_QUESTION_DB_PATH):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self.fts_enabled = False
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._migrate(connection)
+                    self._import_legacy_json(connection)
+                    self.fts_enabled = self._ensure_fts(connection)
+                    self._initialized = True
+        return connection
+
+    @staticmethod
+    def _migrate(connection):
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # executescript would commit the open transaction, so run statements one by one
+                for statement in _split_statements(script):
+                    connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {number}")
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _ensure_fts(connection):
+        """Create and backfill the FTS5 index if missing; returns False when FTS5 is unavailable"""
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'").fetchone():
+            return True
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have created it while this one waited for the write lock
+            if not connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'").fetchone():
+                for statement in _FTS_SCHEMA:
+                    connection.execute(statement)
+            connection.execute("COMMIT")
+            return True
+        except sqlite3.OperationalError as e:
+            connection.execute("ROLLBACK")
+            print(f"Full-text search unavailable, using LIKE search: {e}")
+            return False
+
+    def _import_legacy_json(self, connection):
+        """One-shot import of all_questions.json into an empty store"""
+        if connection.execute("SELECT 1 FROM store_meta WHERE key = 'legacy_json_imported'").fetchone():
+            return
+        if not os.path.exists(self.legacy_json_path):
+            connection.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('legacy_json_imported', 'none')")
+            return
+
+        try:
+            with open(self.legacy_json_path, "r") as f:
+                questions = json.load(f).get("questions", [])
+        except (OSError, json.JSONDecodeError, AttributeError) as e:
+            print(f"Could not import {self.legacy_json_path}: {e}")
+            return
+
+        # The JSON merge kept the first question seen for a title, so existing rows are not overwritten here
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            imported = 0
+            for question in questions:
+                title = question.get("title", "") if isinstance(question, dict) else ""
+                if not title:
+                    continue
+                now = datetime.now().isoformat()
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO questions (title, data, created_at, updated_at, subject, difficulty, "
+                    "source, generated_on) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (title, json.dumps(question), now, now) + self._column_values(question)
+                )
+                imported += cursor.rowcount
+            connection.execute(
+                "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('legacy_json_imported', ?)",
+                (datetime.now().isoformat(),)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        print(f"Imported {imported} questions from {self.legacy_json_path} into {self.path}")
+
+    def get_meta(self, key):
+        """Value stored under key in store_meta, or None"""
+        row = self._connection().execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key, value):
+        self._connection().execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @staticmethod
+    def _column_values(question):
+        return tuple(str(question.get(column) or default) for column, default in FILTER_COLUMNS.items()) + (
+            str(question.get("generated_on") or ""),
+        )
+
+    def upsert_questions(self, questions):
+        """
+        Insert new questions and merge updates into existing ones by title
+
+        Args:
+            questions (list): Question dictionaries with a "title"
+
+        Returns:
+            tuple: (new questions count, updated questions count)
+        """
+        connection = self._connection()
+        new_count = 0
+        updated_count = 0
+        seen_titles = set()
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for question in questions:
+                title = question.get("title", "")
+                if not title or title in seen_titles:
+                    continue
+                seen_titles.add(title)
+                now = datetime.now().isoformat()
+
+                row = connection.execute("SELECT id, data FROM questions WHERE title = ?", (title,)).fetchone()
+                if row:
+                    merged = {**json.loads(row["data"]), **question}
+                    connection.execute(
+                        "UPDATE questions SET data = ?, updated_at = ?, subject = ?, difficulty = ?, source = ?, "
+                        "generated_on = ? WHERE id = ?",
+                        (json.dumps(merged), now) + self._column_values(merged) + (row["id"],)
+                    )
+                    updated_count += 1
+                else:
+                    connection.execute(
+                        "INSERT INTO questions (title, data, created_at, updated_at, subject, difficulty, source, "
+                        "generated_on) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (title, json.dumps(question), now, now) + self._column_values(question)
+                    )
+                    new_count += 1
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        return new_count, updated_count
+
+    def load_all(self):
+        """All questions in insertion order"""
+        rows = self._connection().execute("SELECT data FROM questions ORDER BY id")
+        return [json.loads(row["data"]) for row in rows]
+
+    def count(self):
+        return self._connection().execute("SELECT COALESCE(SUM(count), 0) FROM question_stats").fetchone()[0]
+
+    @staticmethod
+    def _fts_query(search):
+        """FTS5 MATCH expression requiring every search term, each as a prefix"""
+        terms = re.findall(r"\w+", search or "")
+        return " ".join(f'"{term}"*' for term in terms)
+
+    def _where(self, subjects=None, difficulties=None, search=None, alias=""):
+        """
+        WHERE clause for the question filters
+
+        None means "no filter"; an empty list matches nothing, like an empty multiselect.
+        """
+        clauses, params = [], []
+        for column, values in (("subject", subjects), ("difficulty", difficulties)):
+            if values is None:
+                continue
+            values = list(values)
+            if not values:
+                return " WHERE 0", []
+            clauses.append(f"{alias}{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+
+        if search and self.fts_enabled and self._fts_query(search):
+            clauses.append(f"{alias}id IN (SELECT rowid FROM questions_fts WHERE questions_fts MATCH ?)")
+            params.append(self._fts_query(search))
+        elif search:
+            escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append(f"json_extract({alias}data, '$.question') LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query_questions(self, subjects=None, difficulties=None, search=None, limit=50, offset=0):
+        """
+        One page of questions matching the filters, newest first
+
+        Args:
+            subjects (list): Subjects to include (None for all)
+            difficulties (list): Difficulties to include (None for all)
+            search (str): Search text (full-text prefix match, or substring without FTS5)
+            limit (int): Page size (None for all matching questions)
+            offset (int): Number of matching questions to skip
+
+        Returns:
+            list: Question dictionaries
+        """
+        connection = self._connection()
+        where, params = self._where(subjects, difficulties, search)
+        sql = f"SELECT data FROM questions{where} ORDER BY generated_on DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        rows = connection.execute(sql, params)
+        return [json.loads(row["data"]) for row in rows]
+
+    def iter_questions(self, subjects=None, difficulties=None, search=None, batch_size=1000):
+        """
+        Stream questions matching the filters, newest first, fetching batch_size rows at a time
+
+        Uses a dedicated read connection so the WAL snapshot stays consistent
+        while the caller consumes the rows.
+
+        Yields:
+            dict: Question dictionaries
+        """
+        self._connection()
+        where, params = self._where(subjects, difficulties, search)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            cursor = connection.execute(
+                f"SELECT data FROM questions{where} ORDER BY generated_on DESC, id DESC", params
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for (data,) in rows:
+                    yield json.loads(data)
+        finally:
+            connection.close()
+
+    def search_questions(self, search, subjects=None, difficulties=None, limit=50, offset=0):
+        """
+        Full-text search ranked by bm25, with highlighted snippets
+
+        Every term in `search` must match (as a word prefix) in the question,
+        options, explanation or source. Without FTS5 this falls back to a
+        substring match on the question text ordered newest first.
+
+        Returns:
+            list: (question dict, snippet) tuples; matches in the snippet are wrapped in ** for markdown
+        """
+        connection = self._connection()
+        fts_query = self._fts_query(search)
+        if not (self.fts_enabled and fts_query):
+            return [
+                (question, question.get("question", ""))
+                for question in self.query_questions(subjects, difficulties, search, limit, offset)
+            ]
+
+        where, params = self._where(subjects, difficulties, alias="q.")
+        filters = where.replace(" WHERE ", " AND ", 1)
+        weights = ", ".join(str(weight) for weight in FTS_WEIGHTS)
+        sql = (
+            f"SELECT q.data, snippet(questions_fts, -1, '**', '**', '…', {FTS_SNIPPET_TOKENS}) AS snippet "
+            f"FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid "
+            f"WHERE questions_fts MATCH ?{filters} "
+            f"ORDER BY bm25(questions_fts, {weights}) LIMIT ? OFFSET ?"
+        )
+        limit = -1 if limit is None else int(limit)
+        rows = connection.execute(sql, [fts_query] + params + [limit, int(offset)])
+        return [(json.loads(row["data"]), row["snippet"]) for row in rows]
+
+    def count_questions(self, subjects=None, difficulties=None, search=None):
+        """Number of questions matching the filters"""
+        connection = self._connection()
+        where, params = self._where(subjects, difficulties, search)
+        table = "questions" if search else "question_stats"
+        column = "COUNT(*)" if search else "COALESCE(SUM(count), 0)"
+        return connection.execute(f"SELECT {column} FROM {table}{where}", params).fetchone()[0]
+
+    def facet_counts(self, column, subjects=None, difficulties=None, search=None):
+        """
+        Question counts per value of a filter column
+
+        Without a search these come from the question_stats counters, which
+        triggers keep up to date, so the cost does not depend on the bank size.
+
+        Args:
+            column (str): One of STATS_COLUMNS
+            subjects, difficulties, search: Optional filters, as in query_questions
+
+        Returns:
+            dict: Value -> count, sorted by value
+        """
+        if column not in STATS_COLUMNS:
+            raise ValueError(f"Unknown stats column: {column}")
+        connection = self._connection()
+        where, params = self._where(subjects, difficulties, search)
+        if search:
+            sql = f"SELECT {column} AS value, COUNT(*) AS n FROM questions{where} GROUP BY {column} ORDER BY {column}"
+        else:
+            sql = f"SELECT {column} AS value, SUM(count) AS n FROM question_stats{where} GROUP BY {column} ORDER BY {column}"
+        return {row["value"]: row["n"] for row in connection.execute(sql, params)}
+
+# Module-level store shared by the Streamlit sessions of this process
+question_store = QuestionStore()